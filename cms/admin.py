@@ -1,5 +1,54 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Entry, PublishedEntries
+from django.http import QueryDict
+
+from .models import Entry, EntryCounter, PublishedEntries, PublishEvent
+from .paginators import EstimatedCountPaginator
+from .search import get_search_backend, query_terms
+
+
+class UsernameFilter(admin.SimpleListFilter):
+    """Sidebar text box matching an exact username.
+
+    A regular list filter on owner renders one link per user; this looks the
+    typed name up through the username index instead.
+    """
+
+    title = "owner"
+    parameter_name = "owner"
+    template = "admin/cms/input_filter.html"
+    lookup = "owner__username"
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value().strip()})
+        return queryset
+
+    def choices(self, changelist):
+        # The form replaces the query string, so carry the other filters along
+        # (dropping the page number)
+        remaining = changelist.get_query_string(remove=[self.parameter_name, "p"])
+        query_parts = [
+            (name, value)
+            for name, values in QueryDict(remaining.lstrip("?")).lists()
+            for value in values
+        ]
+        yield {
+            "parameter_name": self.parameter_name,
+            "value": self.value() or "",
+            "query_parts": query_parts,
+            "clear_query_string": remaining,
+        }
+
+
+class PublishedUsernameFilter(UsernameFilter):
+    lookup = "owner_username"
 
 
 @admin.register(Entry)
@@ -9,22 +58,34 @@ class EntryAdmin(admin.ModelAdmin):
         "created_at",
         "updated_at",
         "published_at",
+        "publish_at",
         "is_published",
     )
-    list_filter = ("created_at", "updated_at", "published_at", "owner")
-    search_fields = ("contents", "owner__username")
+    list_filter = ("published_at", UsernameFilter)
+    list_select_related = ("owner",)
+    date_hierarchy = "created_at"
+    # contents is stored compressed and cannot be searched with LIKE; an
+    # exact username match uses the index on auth_user.username
+    search_fields = ("=owner__username",)
+    search_help_text = "Exact owner username"
+    autocomplete_fields = ("owner",)
     readonly_fields = ("created_at", "updated_at", "published_at")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_queryset(self, request):
-        # Optimize queries by selecting related user data
-        return super().get_queryset(request).select_related("owner")
+        # The changelist never shows contents; the change form loads them
+        # on access
+        return super().get_queryset(request).defer("contents")
 
 
 @admin.register(PublishedEntries)
 class PublishedEntriesAdmin(admin.ModelAdmin):
     list_display = ("owner_username", "published_at", "created_at")
-    list_filter = ("published_at", "owner_username")
-    search_fields = ("contents", "owner_username")
+    list_filter = (PublishedUsernameFilter,)
+    date_hierarchy = "published_at"
+    search_fields = ("=owner_username",)
+    search_help_text = "Exact owner username, or words from the contents"
     readonly_fields = (
         "original_entry",
         "owner_username",
@@ -33,7 +94,56 @@ class PublishedEntriesAdmin(admin.ModelAdmin):
         "updated_at",
         "published_at",
     )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer("contents", "contents_html")
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term
+        )
+        terms = query_terms(search_term)
+        if terms:
+            # Contents are matched through the full-text index, never LIKE
+            limit = getattr(settings, "CMS_SEARCH_ADMIN_LIMIT", 1000)
+            entry_ids = get_search_backend().match_ids(terms, limit)
+            results |= queryset.filter(original_entry_id__in=entry_ids)
+        return results, may_have_duplicates
 
     def has_add_permission(self, request):
         # Prevent manual creation of published entries
         return False
+
+
+@admin.register(PublishEvent)
+class PublishEventAdmin(admin.ModelAdmin):
+    list_display = ("entry_id", "kind", "status", "attempts", "coalesced", "available_at")
+    list_filter = ("status", "kind")
+    readonly_fields = (
+        "entry_id",
+        "kind",
+        "attempts",
+        "coalesced",
+        "last_error",
+        "created_at",
+        "updated_at",
+    )
+
+    def has_add_permission(self, request):
+        # Events are only queued by Entry.publish/unpublish
+        return False
+
+
+@admin.register(EntryCounter)
+class EntryCounterAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "owner_id", "entries", "published")
+    ordering = ("owner_id",)
+
+    def has_add_permission(self, request):
+        # Counters are only written by the publish path (cms.counters)
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
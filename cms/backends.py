@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .timing import span
+
+
+def _user_cache_key(user_id) -> str:
+    return f"cms_user_{user_id}"
+
+
+def invalidate_cached_users(user_ids):
+    """Drop cached user snapshots so the next request reloads them.
+
+    They are dropped again once the current transaction commits, since a
+    request that read the old row before the commit may have cached it anew.
+    """
+    keys = [_user_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _snapshot(user) -> dict:
+    return {
+        "fields": {
+            field.attname: getattr(user, field.attname)
+            for field in User._meta.concrete_fields
+        },
+        "groups": [group.name for group in user.groups.all()],
+    }
+
+
+def _from_snapshot(snapshot) -> User:
+    fields = snapshot["fields"]
+    user = User.from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+    user._cms_group_names = snapshot["groups"]
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend that loads the session's user from the cache.
+
+    The user row and group names are cached together for
+    ``CMS_USER_CACHE_TIMEOUT`` seconds, so authenticated requests need no
+    queries for identity. Snapshots are dropped whenever the user, their
+    groups or a group's name change, and on logout (see cms.signals).
+    """
+
+    def get_user(self, user_id):
+        key = _user_cache_key(user_id)
+        with span("cache", "user"):
+            snapshot = cache.get(key)
+        if snapshot is None:
+            user = User._default_manager.prefetch_related("groups").filter(pk=user_id).first()
+            if user is None:
+                return None
+            snapshot = _snapshot(user)
+            cache.set(key, snapshot, getattr(settings, "CMS_USER_CACHE_TIMEOUT", 300))
+        user = _from_snapshot(snapshot)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,251 @@
+import functools
+import hashlib
+import io
+import json
+import logging
+import tarfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from django.db.models import Max
+
+from .models import PolicyDataChange
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_ROOTS = ["cms", "users"]
+
+
+def get_policy_file() -> Path:
+    return Path(
+        getattr(settings, "OPA_POLICY_FILE", settings.BASE_DIR / "cms_authz.rego")
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _policy_source(path: Path, mtime: float) -> bytes:
+    return path.read_bytes()
+
+
+def get_policy_source() -> bytes:
+    """Contents of the policy file, re-read only when it changes on disk"""
+    path = get_policy_file()
+    return _policy_source(path, path.stat().st_mtime)
+
+
+def policy_digest() -> str:
+    return hashlib.sha256(get_policy_source()).hexdigest()[:16]
+
+
+def latest_change_id() -> int:
+    latest = PolicyDataChange.objects.order_by("-id").values_list("id", flat=True).first()
+    return latest or 0
+
+
+def _delta_overlap() -> int:
+    return getattr(settings, "OPA_BUNDLE_DELTA_OVERLAP", 100)
+
+
+def current_revision() -> str:
+    """Bundle revision: ``<policy digest>.<last change id>.<recent changes>``.
+
+    Change ids are assigned at insert but may commit out of order, so a
+    lower id can appear after OPA saw a higher one. The number of changes
+    in the last ``OPA_BUNDLE_DELTA_OVERLAP`` ids makes such a late commit
+    change the revision, and deltas re-send that window.
+    """
+    latest = latest_change_id()
+    recent = PolicyDataChange.objects.filter(id__gt=latest - _delta_overlap()).count()
+    return f"{policy_digest()}.{latest}.{recent}"
+
+
+def parse_revision(revision: str):
+    """Split a revision into (policy digest, change id, recent changes), or
+    None if malformed"""
+    digest, change_id, recent = (revision.split(".") + ["", ""])[:3]
+    if not digest or not change_id.isdigit() or not recent.isdigit():
+        return None
+    return digest, int(change_id), int(recent)
+
+
+def bundle_clients() -> dict:
+    """``{client name: bearer token}`` of the OPA instances allowed to fetch
+    bundles: ``OPA_BUNDLE_TOKENS``, or ``OPA_BUNDLE_TOKEN`` as client ``opa``
+    """
+    clients = dict(getattr(settings, "OPA_BUNDLE_TOKENS", None) or {})
+    token = getattr(settings, "OPA_BUNDLE_TOKEN", None)
+    if token and not clients:
+        clients["opa"] = token
+    return clients
+
+
+def authenticate_bundle_client(authorization: str):
+    """Name of the client whose token is in the Authorization header, or None"""
+    for name, token in bundle_clients().items():
+        if constant_time_compare(authorization, f"Bearer {token}"):
+            return name
+    return None
+
+
+# ============= DECISION CACHE VERSIONING =============
+# With OPA_USE_BUNDLE_DATA the decision input no longer holds groups or
+# staff status, so it carries the user's latest change id instead; a change
+# moves the user's decisions to new cache keys. Until OPA has fetched a
+# bundle with that change, its answers still reflect the old data and are
+# not cached at all. OPA reports the revision it holds in If-None-Match on
+# every poll; that, per client, is what counts as delivered.
+
+
+def _acked_change_key(client) -> str:
+    return f"opa_bundle_acked_change_{client}"
+
+
+def _user_change_key(user_id) -> str:
+    return f"opa_user_change_{user_id}"
+
+
+def user_change_id(user_id) -> int:
+    """Id of the user's latest policy data change (0 if none is logged)"""
+    key = _user_change_key(user_id)
+    change_id = cache.get(key)
+    if change_id is None:
+        change_id = (
+            PolicyDataChange.objects.filter(user_id=user_id).aggregate(latest=Max("id"))["latest"]
+            or 0
+        )
+        cache.set(key, change_id, None)
+    return change_id
+
+
+def served_change_id() -> int:
+    """Newest change id every configured OPA client has acknowledged holding
+    (0 until each of them has polled with a current revision)"""
+    keys = [_acked_change_key(client) for client in bundle_clients()]
+    if not keys:
+        return 0
+    acked = cache.get_many(keys)
+    return min(acked.get(key, 0) for key in keys)
+
+
+def acknowledged_change_id(revision) -> int:
+    """Newest change id known to be in a parsed revision a client holds.
+
+    A change committed late with an id below the revision's is not in it;
+    if the count of changes in the revision's window no longer matches,
+    only the ids below that window are known to be included.
+    """
+    if revision is None or revision[0] != policy_digest():
+        return 0
+    _, change_id, recent = revision
+    window_start = max(change_id - _delta_overlap(), 0)
+    now_recent = PolicyDataChange.objects.filter(
+        id__gt=window_start, id__lte=change_id
+    ).count()
+    return change_id if now_recent == recent else window_start
+
+
+def record_acknowledged_revision(client: str, revision):
+    """Remember what ``client`` holds; a restarted OPA holding nothing resets it"""
+    cache.set(_acked_change_key(client), acknowledged_change_id(revision), None)
+
+
+def record_policy_data_change(user_ids):
+    """Log that these users' policy data changed and trim the change log"""
+    changes = PolicyDataChange.objects.bulk_create(
+        [PolicyDataChange(user_id=user_id) for user_id in set(user_ids)]
+    )
+    if not changes:
+        return
+    # Looked up again from the database, once the new ids are visible
+    keys = [_user_change_key(change.user_id) for change in changes]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+    keep = getattr(settings, "OPA_BUNDLE_CHANGELOG_SIZE", 10000)
+    newest = latest_change_id()
+    PolicyDataChange.objects.filter(id__lte=newest - keep).delete()
+
+
+def user_documents(user_ids=None) -> dict:
+    """``data.users`` entries keyed by user id, for active users"""
+    users = User.objects.filter(is_active=True)
+    memberships = User.groups.through.objects.filter(user__is_active=True)
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+        memberships = memberships.filter(user_id__in=user_ids)
+
+    documents = {
+        str(user_id): {"username": username, "is_staff": is_staff, "groups": []}
+        for user_id, username, is_staff in users.values_list("id", "username", "is_staff")
+    }
+    for user_id, group_name in memberships.values_list("user_id", "group__name"):
+        document = documents.get(str(user_id))
+        if document is not None:
+            document["groups"].append(group_name.lower())
+    return documents
+
+
+def _tarball(files: dict) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def build_snapshot_bundle(revision: str) -> bytes:
+    """Full bundle: the policy plus data.users for every active user"""
+    cache_key = f"opa_bundle_snapshot_{revision}"
+    bundle = cache.get(cache_key)
+    if bundle is not None:
+        return bundle
+
+    manifest = {"revision": revision, "roots": BUNDLE_ROOTS}
+    bundle = _tarball({
+        ".manifest": json.dumps(manifest).encode(),
+        "cms/authz/policy.rego": get_policy_source(),
+        "users/data.json": json.dumps(user_documents()).encode(),
+    })
+    cache.set(cache_key, bundle, getattr(settings, "OPA_BUNDLE_CACHE_TIMEOUT", 3600))
+    logger.debug(f"Built OPA snapshot bundle {revision} ({len(bundle)} bytes)")
+    return bundle
+
+
+def build_delta_bundle(since_change_id: int, revision: str):
+    """Delta bundle patching the users changed since ``since_change_id``.
+
+    Returns None when a delta cannot be built (the change log no longer
+    reaches back that far, or too many users changed) so a snapshot is sent.
+    """
+    # Re-send a window below OPA's revision too: ids there may have
+    # committed after OPA fetched it
+    changes = PolicyDataChange.objects.filter(
+        id__gt=max(since_change_id - _delta_overlap(), 0)
+    )
+    oldest = PolicyDataChange.objects.order_by("id").values_list("id", flat=True).first()
+    if oldest is None or oldest > since_change_id + 1:
+        return None
+
+    user_ids = set(changes.values_list("user_id", flat=True))
+    if len(user_ids) > getattr(settings, "OPA_BUNDLE_MAX_DELTA_USERS", 500):
+        return None
+
+    documents = user_documents(user_ids)
+    operations = []
+    for user_id in sorted(user_ids):
+        key = str(user_id)
+        # Deleted or deactivated users get an empty document rather than a
+        # "remove", which OPA rejects for paths it never had
+        document = documents.get(key, {"username": None, "is_staff": False, "groups": []})
+        operations.append({"op": "upsert", "path": f"/users/{key}", "value": document})
+
+    manifest = {"revision": revision, "roots": BUNDLE_ROOTS}
+    return _tarball({
+        ".manifest": json.dumps(manifest).encode(),
+        "patch.json": json.dumps({"data": operations}).encode(),
+    })
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .bundle import bundle_clients
+
+
+@register(Tags.security)
+def check_bundle_token(app_configs, **kwargs):
+    """Bundle data needs the bundle server, which needs a token"""
+    if getattr(settings, "OPA_USE_BUNDLE_DATA", False) and not bundle_clients():
+        return [
+            Error(
+                "OPA_USE_BUNDLE_DATA is on but no OPA_BUNDLE_TOKEN(S) is set, so "
+                "the bundle server refuses to serve user data to OPA.",
+                hint="Set OPA_BUNDLE_TOKEN, or OPA_BUNDLE_TOKENS with one token per OPA instance.",
+                id="cms.E001",
+            )
+        ]
+    return []
@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Entry, EntryCounter
+
+# owner_id of the row holding the site-wide totals
+ALL_OWNERS = 0
+
+
+def adjust(deltas):
+    """Apply ``{owner_id: (entries, published)}`` changes, and their sum to
+    the site-wide row, in the current transaction.
+
+    Rows are updated in owner order so concurrent publishes lock them in
+    the same order and cannot deadlock.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    for owner_id, (entries, published) in deltas.items():
+        for key in (owner_id, ALL_OWNERS):
+            totals[key][0] += entries
+            totals[key][1] += published
+    changes = {key: change for key, change in totals.items() if any(change)}
+    if not changes:
+        return
+
+    with transaction.atomic():
+        EntryCounter.objects.bulk_create(
+            [EntryCounter(owner_id=key) for key in changes], ignore_conflicts=True
+        )
+        for key in sorted(changes):
+            entries, published = changes[key]
+            EntryCounter.objects.filter(owner_id=key).update(
+                entries=F("entries") + entries, published=F("published") + published
+            )
+
+
+def adjust_one(owner_id, entries=0, published=0):
+    adjust({owner_id: (entries, published)})
+
+
+def entry_deltas(entries, sign=1) -> dict:
+    """Counter changes for adding (or, with ``sign=-1``, removing) entries"""
+    deltas = defaultdict(lambda: [0, 0])
+    for entry in entries:
+        deltas[entry.owner_id][0] += sign
+        if entry.published_at is not None:
+            deltas[entry.owner_id][1] += sign
+    return deltas
+
+
+def counts(owner_id=ALL_OWNERS) -> tuple:
+    """``(entries, published)`` of one owner, or of all of them"""
+    row = (
+        EntryCounter.objects.filter(owner_id=owner_id)
+        .values_list("entries", "published")
+        .first()
+    )
+    return row or (0, 0)
+
+
+def actual_counts() -> dict:
+    """``{owner_id: (entries, published)}`` counted from the entries table"""
+    rows = Entry.objects.values_list("owner_id").annotate(
+        entries=Count("pk"), published=Count("published_at")
+    ).order_by()
+    actual = {owner_id: (entries, published) for owner_id, entries, published in rows}
+    actual[ALL_OWNERS] = (
+        sum(entries for entries, _ in actual.values()),
+        sum(published for _, published in actual.values()),
+    )
+    return actual
+
+
+def _lock_row(owner_id):
+    """Create (if needed) and lock one counter row"""
+    EntryCounter.objects.bulk_create([EntryCounter(owner_id=owner_id)], ignore_conflicts=True)
+    return EntryCounter.objects.select_for_update().get(owner_id=owner_id)
+
+
+def _recount_owner(owner_id):
+    with transaction.atomic():
+        row = _lock_row(owner_id)
+        # Uses the (owner, created_at) index; publishes of this owner wait
+        # for the row lock, nobody else does
+        counted = Entry.objects.filter(owner_id=owner_id).aggregate(
+            entries=Count("pk"), published=Count("published_at")
+        )
+        if not counted["entries"]:
+            row.delete()
+            return
+        row.entries, row.published = counted["entries"], counted["published"]
+        row.save(update_fields=["entries", "published"])
+
+
+def _resum_all_owners() -> bool:
+    """Set the site-wide row to the sum of the owner rows; True if it changed.
+
+    Publishes lock the site-wide row first, so while it is held no change
+    to an owner row is half done.
+    """
+    with transaction.atomic():
+        row = _lock_row(ALL_OWNERS)
+        totals = EntryCounter.objects.exclude(owner_id=ALL_OWNERS).aggregate(
+            entries=Sum("entries"), published=Sum("published")
+        )
+        summed = (totals["entries"] or 0, totals["published"] or 0)
+        if (row.entries, row.published) == summed:
+            return False
+        row.entries, row.published = summed
+        row.save(update_fields=["entries", "published"])
+        return True
+
+
+def recount(dry_run=False) -> int:
+    """Rewrite every counter that drifted from the entries table (writes
+    that bypassed the publish path, such as ``QuerySet.update``). Returns
+    the number of rows fixed, or with ``dry_run`` that would be.
+
+    Drift is found with one unlocked scan; only drifted owners are then
+    recounted, each under a lock on its own row.
+    """
+    actual = actual_counts()
+    stored = {
+        owner_id: (entries, published)
+        for owner_id, entries, published
+        in EntryCounter.objects.values_list("owner_id", "entries", "published")
+    }
+    drifted = sorted(
+        owner_id
+        for owner_id in actual.keys() | stored.keys()
+        if owner_id != ALL_OWNERS and actual.get(owner_id) != stored.get(owner_id)
+    )
+    totals_drifted = actual[ALL_OWNERS] != stored.get(ALL_OWNERS)
+    if dry_run:
+        return len(drifted) + totals_drifted
+
+    for owner_id in drifted:
+        _recount_owner(owner_id)
+    fixed_totals = (drifted or totals_drifted) and _resum_all_owners()
+    return len(drifted) + bool(fixed_totals)
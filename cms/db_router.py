@@ -0,0 +1,100 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+# Set for the remainder of a request once it has written to the primary, so
+# that follow-up reads in the same request see their own writes.
+_pinned_to_primary = ContextVar("cms_pinned_to_primary", default=False)
+
+
+def pin_to_primary():
+    """Route every following read in the current context to the primary"""
+    _pinned_to_primary.set(True)
+
+
+def is_pinned_to_primary() -> bool:
+    return _pinned_to_primary.get()
+
+
+# Statements that change data; reads, savepoints and session settings do not
+# pin a request to the primary
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "ALTER", "DROP", "TRUNCATE")
+
+
+def pin_on_write(execute, sql, params, many, context):
+    """Execute wrapper that pins the current context when a statement writes"""
+    if sql.lstrip()[:8].upper().startswith(WRITE_STATEMENTS):
+        pin_to_primary()
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def pin_after_writes(pinned=False):
+    """Scope of one request or unit of work: reads may use replicas until it
+    writes to the primary, then stay on the primary until the scope ends.
+
+    The wrapper is installed for the scope only; other scoped wrappers
+    (query timing) pop theirs in order around it.
+    """
+    token = _pinned_to_primary.set(pinned)
+    try:
+        with connections[ReplicaRouter.primary].execute_wrapper(pin_on_write):
+            yield
+    finally:
+        _pinned_to_primary.reset(token)
+
+
+def get_replica_aliases() -> list:
+    """Database aliases that serve replica reads"""
+    replicas = getattr(settings, "DATABASE_REPLICAS", None)
+    if replicas is None:
+        replicas = [alias for alias in settings.DATABASES if alias != "default"]
+    return list(replicas)
+
+
+class ReplicaRouter:
+    """Send listing reads to read replicas and everything else to the primary.
+
+    Reads for models in ``DATABASE_REPLICA_MODELS`` go to a random alias from
+    ``DATABASE_REPLICAS`` unless the current request has written (or recently
+    wrote, see ``PrimaryPinningMiddleware``), in which case they stay on the
+    primary for read-your-writes consistency. Writes are detected by
+    ``pin_on_write`` within a ``pin_after_writes`` scope.
+    """
+
+    primary = "default"
+
+    def _routes_to_replica(self, model) -> bool:
+        routed_models = getattr(
+            settings,
+            "DATABASE_REPLICA_MODELS",
+            ["cms.entry", "cms.publishedentries"],
+        )
+        return model._meta.label_lower in routed_models
+
+    def db_for_read(self, model, **hints):
+        if is_pinned_to_primary() or not self._routes_to_replica(model):
+            return self.primary
+
+        replicas = get_replica_aliases()
+        if not replicas:
+            return self.primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Pinning happens when a write actually runs (pin_on_write), not on
+        # lookups that merely ask where writes would go
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {self.primary, *get_replica_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication
+        return db == self.primary
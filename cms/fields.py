@@ -0,0 +1,158 @@
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+# One-byte header in front of every stored value
+RAW = b"\x00"
+ZLIB = b"\x01"
+ZSTD = b"\x02"
+
+
+def compress_text(value: str, threshold: int, algorithm: str, level: int) -> bytes:
+    """Encode ``value`` for storage, compressing it when it is large enough"""
+    data = value.encode("utf-8")
+    if len(data) < threshold:
+        return RAW + data
+
+    if algorithm == "zstd" and zstandard is not None:
+        compressed = ZSTD + zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        compressed = ZLIB + zlib.compress(data, level)
+
+    # Incompressible data is cheaper to store as-is
+    if len(compressed) >= len(data) + 1:
+        return RAW + data
+    return compressed
+
+
+def decompress_text(data: bytes) -> str:
+    """Decode a value written by ``compress_text``"""
+    header, payload = data[:1], data[1:]
+    if header == ZLIB:
+        payload = zlib.decompress(payload)
+    elif header == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed contents")
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    elif header != RAW:
+        raise ValueError(f"Unknown compressed text header: {header!r}")
+    return payload.decode("utf-8")
+
+
+class CompressedValue:
+    """Stored bytes of a compressed field, decompressed only when read.
+
+    Model instances hold this until the attribute is accessed, so rows that
+    are loaded but never display their contents skip decompression, and
+    saving an untouched instance writes the bytes back without recompressing.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __str__(self):
+        return decompress_text(self.data)
+
+    def __repr__(self):
+        return f"<CompressedValue: {len(self.data)} bytes>"
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Decompress on first access and keep the text on the instance"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedValue):
+            value = str(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """A TextField stored as (optionally) compressed bytes.
+
+    Values shorter than ``threshold`` bytes are stored raw; longer ones are
+    compressed with zlib, or zstd when ``algorithm="zstd"`` and the
+    ``zstandard`` package is installed. Defaults come from the
+    ``CMS_COMPRESSION_*`` settings. The column is binary, so text lookups
+    such as ``icontains`` do not work on it.
+    """
+
+    descriptor_class = CompressedTextDescriptor
+
+    def __init__(self, *args, threshold=None, algorithm=None, level=None, **kwargs):
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.level = level
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        for option in ("threshold", "algorithm", "level"):
+            if getattr(self, option) is not None:
+                kwargs[option] = getattr(self, option)
+        return name, path, args, kwargs
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def _compress(self, value: str) -> bytes:
+        threshold = self.threshold
+        if threshold is None:
+            threshold = getattr(settings, "CMS_COMPRESSION_THRESHOLD", 1024)
+        algorithm = self.algorithm or getattr(settings, "CMS_COMPRESSION_ALGORITHM", "zlib")
+        level = self.level
+        if level is None:
+            level = getattr(settings, "CMS_COMPRESSION_LEVEL", 6)
+        return compress_text(value, threshold, algorithm, level)
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            # Rows written before the column was converted hold plain text
+            return value
+        return CompressedValue(bytes(value))
+
+    def to_python(self, value):
+        if isinstance(value, CompressedValue):
+            return str(value)
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(bytes(value))
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Read the raw attribute so untouched values skip a decompress/compress
+        # round trip
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        if isinstance(value, CompressedValue):
+            return value.data
+        if isinstance(value, (bytes, memoryview)):
+            return bytes(value)
+        return self._compress(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
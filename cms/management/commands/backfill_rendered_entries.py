@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cms.models import Entry, PublishedEntries
+from cms.rendering import make_excerpt, render_contents
+
+
+class Command(BaseCommand):
+    help = 'Fill in stored excerpts and pre-rendered HTML for existing entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of rows rendered and written per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-render every row, not only rows that were never rendered',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        entries = Entry.objects.only('pk', 'contents')
+        published = PublishedEntries.objects.only('pk', 'contents')
+        if not options['all']:
+            entries = entries.filter(excerpt='')
+            published = published.filter(contents_html='')
+
+        entry_count = self._backfill(
+            entries, chunk_size, lambda entry: {'excerpt': make_excerpt(entry.contents)}
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ Updated excerpts for {entry_count} entries')
+        )
+
+        published_count = self._backfill(
+            published,
+            chunk_size,
+            lambda entry: {'contents_html': render_contents(entry.contents)},
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ Rendered HTML for {published_count} published entries')
+        )
+
+    def _backfill(self, queryset, chunk_size, render):
+        """Render rows in primary-key order, one bulk_update per chunk"""
+        updated = 0
+        last_pk = 0
+
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not batch:
+                return updated
+
+            fields = None
+            for obj in batch:
+                values = render(obj)
+                fields = list(values)
+                for name, value in values.items():
+                    setattr(obj, name, value)
+
+            with transaction.atomic():
+                queryset.model.objects.bulk_update(batch, fields)
+
+            updated += len(batch)
+            last_pk = batch[-1].pk
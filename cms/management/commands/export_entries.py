@@ -0,0 +1,84 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from cms.models import Entry
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+class Command(BaseCommand):
+    help = 'Stream entries and their published versions to a JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output',
+            nargs='?',
+            default='-',
+            help='File to write (default: standard output)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Rows fetched from the database per batch (default: 2000)',
+        )
+        parser.add_argument(
+            '--published-only',
+            action='store_true',
+            help='Only export entries that have a published version',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # One query per chunk: owner and published version are joined in, and
+        # only the stored texts needed to recreate the rows are loaded
+        entries = (
+            Entry.objects.select_related('owner', 'published_version')
+            .defer('excerpt', 'published_version__contents_html')
+            .order_by('pk')
+        )
+        if options['published_only']:
+            entries = entries.filter(published_version__isnull=False)
+
+        output = sys.stdout if options['output'] == '-' else open(
+            options['output'], 'w', encoding='utf-8'
+        )
+        # Progress goes to stderr so the JSONL can be piped
+        progress = self.stderr
+        exported = 0
+        started = time.monotonic()
+        try:
+            for entry in entries.iterator(chunk_size=chunk_size):
+                output.write(json.dumps(self._serialize(entry), ensure_ascii=False))
+                output.write('\n')
+                exported += 1
+                if exported % chunk_size == 0:
+                    rate = exported / (time.monotonic() - started)
+                    progress.write(f'   Exported {exported} entries ({rate:.0f}/s)...')
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        progress.write(self.style.SUCCESS(f'✅ Exported {exported} entries'))
+
+    def _serialize(self, entry):
+        published = getattr(entry, 'published_version', None)
+        return {
+            'owner': entry.owner.username,
+            'contents': entry.contents,
+            'created_at': _isoformat(entry.created_at),
+            'updated_at': _isoformat(entry.updated_at),
+            'published_at': _isoformat(entry.published_at),
+            'published': {
+                'owner_username': published.owner_username,
+                'contents': published.contents,
+                'created_at': _isoformat(published.created_at),
+                'updated_at': _isoformat(published.updated_at),
+                'published_at': _isoformat(published.published_at),
+            } if published is not None else None,
+        }
@@ -0,0 +1,198 @@
+import contextlib
+import itertools
+import json
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from cms.counters import adjust, entry_deltas
+from cms.models import Entry, PublishedEntries
+from cms.page_cache import bump_page_generation
+from cms.rendering import make_excerpt, render_contents
+from cms.search import get_search_backend
+
+
+def _datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'invalid datetime {value!r}')
+    return parsed
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise TypeError(f'contents must be a string, not {type(value).__name__}')
+    return value
+
+
+def _parse_record(line):
+    """Decode one export line, raising ValueError/KeyError/TypeError on any
+    missing or malformed field"""
+    record = json.loads(line)
+    version = record.get('published')
+    if version:
+        version = {
+            'owner_username': version.get('owner_username', record['owner']),
+            'contents': _text(version['contents']),
+            'created_at': _datetime(version.get('created_at')),
+            'updated_at': _datetime(version.get('updated_at')),
+            'published_at': _datetime(version.get('published_at')),
+        }
+    return {
+        'owner': record['owner'],
+        'contents': _text(record['contents']),
+        'created_at': _datetime(record.get('created_at')),
+        'updated_at': _datetime(record.get('updated_at')),
+        'published_at': _datetime(record.get('published_at')),
+        'published': version,
+    }
+
+
+@contextlib.contextmanager
+def preserve_timestamps(model):
+    """Let bulk_create keep the given created_at/updated_at values.
+
+    auto_now/auto_now_add overwrite them in pre_save; this command is the
+    only writer in its process, so the flags are switched off for its run.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Import entries and their published versions from a JSONL export'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            nargs='?',
+            default='-',
+            help='File written by export_entries (default: standard input)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Entries written per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--skip-unknown-owners',
+            action='store_true',
+            help='Skip entries whose owner does not exist instead of stopping',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        # Resolve owners in memory instead of one query per line
+        self.owner_ids = dict(User.objects.values_list('username', 'id'))
+        self.skip_unknown = options['skip_unknown_owners']
+        self.search = get_search_backend()
+
+        source = sys.stdin if options['input'] == '-' else open(
+            options['input'], encoding='utf-8'
+        )
+        imported = published = skipped = 0
+        started = time.monotonic()
+        try:
+            lines = (
+                (number, line) for number, line in enumerate(source, start=1) if line.strip()
+            )
+            with preserve_timestamps(Entry):
+                while True:
+                    chunk = list(itertools.islice(lines, chunk_size))
+                    if not chunk:
+                        break
+                    created, created_published, chunk_skipped = self._import_chunk(chunk)
+                    imported += created
+                    published += created_published
+                    skipped += chunk_skipped
+                    rate = imported / (time.monotonic() - started)
+                    self.stdout.write(f'   Imported {imported} entries ({rate:.0f}/s)...')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        if published:
+            bump_page_generation()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✅ Imported {imported} entries ({published} published)'
+                + (f', skipped {skipped} with unknown owners' if skipped else '')
+            )
+        )
+
+    def _import_chunk(self, chunk):
+        entries = []
+        records = []
+        skipped = 0
+        # Seed files may leave timestamps out
+        now = timezone.now()
+        for number, line in chunk:
+            try:
+                record = _parse_record(line)
+                owner_id = self.owner_ids.get(record['owner'])
+            except KeyError as e:
+                raise CommandError(f'Line {number}: invalid entry record (missing {e})')
+            except (ValueError, TypeError, AttributeError) as e:
+                raise CommandError(f'Line {number}: invalid entry record ({e})')
+            if owner_id is None:
+                if self.skip_unknown:
+                    skipped += 1
+                    continue
+                raise CommandError(f"Line {number}: unknown owner {record['owner']!r}")
+
+            created_at = record['created_at'] or now
+            entries.append(Entry(
+                owner_id=owner_id,
+                contents=record['contents'],
+                excerpt=make_excerpt(record['contents']),
+                created_at=created_at,
+                updated_at=record['updated_at'] or created_at,
+                published_at=record['published_at'],
+            ))
+            records.append(record)
+
+        with transaction.atomic():
+            Entry.objects.bulk_create(entries)
+            adjust(entry_deltas(entries))
+            published = []
+            for entry, record in zip(entries, records):
+                version = record['published']
+                if not version:
+                    continue
+                if entry.pk is None:
+                    raise CommandError(
+                        'This database does not return ids from bulk inserts, '
+                        'so published versions cannot be linked'
+                    )
+                published.append(PublishedEntries(
+                    original_entry_id=entry.pk,
+                    owner_username=version['owner_username'],
+                    contents=version['contents'],
+                    contents_html=render_contents(version['contents']),
+                    created_at=version['created_at'] or entry.created_at,
+                    updated_at=version['updated_at'] or entry.updated_at,
+                    published_at=version['published_at'] or now,
+                ))
+            PublishedEntries.objects.bulk_create(published)
+            self.search.index_many([
+                (row.original_entry_id, row.owner_username, row.contents) for row in published
+            ])
+        return len(entries), len(published), skipped
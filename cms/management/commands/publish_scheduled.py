@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cms.db_router import pin_after_writes
+from cms.scheduling import publish_due_entries
+
+
+class Command(BaseCommand):
+    help = 'Publish entries whose scheduled publish_at time has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Publish the entries that are due now, then exit',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Entries published per transaction (default: 100)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=15.0,
+            help='Seconds to sleep when nothing is due (default: 15)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('⏰ Scheduled publisher started'))
+        try:
+            while True:
+                with pin_after_writes():
+                    published = publish_due_entries(options['batch_size'])
+                if published:
+                    self.stdout.write(f'✅ Published {published} scheduled entries')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('👋 Scheduled publisher stopped'))
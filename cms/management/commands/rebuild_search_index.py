@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cms.models import PublishedEntries
+from cms.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the published entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of entries indexed per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        backend = get_search_backend()
+        self.stdout.write(
+            self.style.SUCCESS(f'🔎 Rebuilding search index ({type(backend).__name__})\n')
+        )
+
+        published = PublishedEntries.objects.only(
+            'pk', 'original_entry_id', 'owner_username', 'contents'
+        )
+        indexed = 0
+        last_pk = 0
+        with transaction.atomic():
+            # Searches keep seeing the old index until the rebuild commits
+            backend.clear()
+            while True:
+                batch = list(published.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+                if not batch:
+                    break
+                backend.index_many(
+                    [(entry.original_entry_id, entry.owner_username, entry.contents)
+                     for entry in batch]
+                )
+                indexed += len(batch)
+                last_pk = batch[-1].pk
+                self.stdout.write(f'   Indexed {indexed} entries...')
+
+        backend.optimize()
+        self.stdout.write(self.style.SUCCESS(f'✅ Indexed {indexed} published entries'))
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cms.reconcile import divergence_counts, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Find and repair PublishedEntries rows and entry counters that disagree with the entries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many rows diverge',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Rows repaired per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep reconciling every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=300.0,
+            help='Seconds between runs with --loop (default: 300)',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('🔍 Divergent rows:'))
+            for kind, count in divergence_counts().items():
+                self.stdout.write(f'   {kind}: {count}')
+            return
+
+        try:
+            while True:
+                self._run(options['chunk_size'])
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def _run(self, chunk_size):
+        started = time.monotonic()
+        repaired = reconcile(
+            chunk_size,
+            progress=lambda kind, count: self.stdout.write(f'   Repaired {count} {kind}...'),
+        )
+        elapsed = time.monotonic() - started
+        summary = ', '.join(f'{count} {kind}' for kind, count in repaired.items())
+        self.stdout.write(self.style.SUCCESS(f'✅ Reconciled in {elapsed:.1f}s: {summary}'))
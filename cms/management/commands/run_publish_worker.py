@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from cms import pipeline
+from cms.db_router import pin_after_writes
+
+
+class Command(BaseCommand):
+    help = 'Process queued post-publish events (cache invalidation, feeds, exports, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process the events that are due now, then exit',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Events claimed per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Seconds to sleep when the queue is empty (default: 2)',
+        )
+        parser.add_argument(
+            '--purge-after-days',
+            type=int,
+            default=7,
+            help='Delete finished events older than this many days (default: 7)',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print pipeline metrics and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self._print_stats()
+            return
+
+        purge_after = timedelta(days=options['purge_after_days'])
+        purged = pipeline.purge_finished(purge_after)
+        if purged:
+            self.stdout.write(f'🧹 Purged {purged} finished events')
+
+        self.stdout.write(self.style.SUCCESS('🚀 Publish worker started'))
+        try:
+            while True:
+                with pin_after_writes():
+                    handled = pipeline.run_pending(options['batch_size'])
+                if handled:
+                    self.stdout.write(f'✅ Processed {handled} events')
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('👋 Publish worker stopped'))
+
+    def _print_stats(self):
+        self.stdout.write(self.style.SUCCESS('📊 Post-publish pipeline:'))
+        for name, value in pipeline.get_metrics().items():
+            self.stdout.write(f'   {name}: {value}')
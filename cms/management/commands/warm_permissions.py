@@ -0,0 +1,89 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from cms.opa_client import opa_client
+
+
+class Command(BaseCommand):
+    help = 'Warm the OPA decision cache for all active users (run after a deploy or policy change)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames',
+            nargs='*',
+            help='Only warm these users (default: every active user)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of concurrent OPA queries (default: 4)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Users loaded from the database per batch (default: 200)',
+        )
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], (LocMemCache, DummyCache)):
+            # Decisions would only land in this short-lived process
+            raise CommandError(
+                'The default cache is process-local, so the web workers would '
+                'not see the warmed decisions; configure a shared cache '
+                '(Redis/Memcached/database) first'
+            )
+
+        users = User.objects.filter(is_active=True).prefetch_related('groups')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        warmed_users = 0
+        failed_users = 0
+        skipped_users = 0
+        decisions = 0
+
+        # Groups are prefetched here, so the worker threads only talk to OPA.
+        # One chunk is submitted at a time, so at most --chunk-size users
+        # (and their pending results) are held in memory.
+        chunk_size = options['chunk_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            chunks = itertools.batched(
+                users.order_by('pk').iterator(chunk_size=chunk_size), chunk_size
+            )
+            for chunk in chunks:
+                for count in executor.map(opa_client.warm_user_decisions, chunk):
+                    if count is None:
+                        skipped_users += 1
+                    elif count:
+                        warmed_users += 1
+                        decisions += count
+                    else:
+                        failed_users += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'🔥 Warmed {decisions} decisions for {warmed_users} user{"s" if warmed_users != 1 else ""}'
+            )
+        )
+        if failed_users:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️  Could not warm {failed_users} user{"s" if failed_users != 1 else ""} - is OPA reachable?'
+                )
+            )
+        if skipped_users:
+            self.stdout.write(
+                self.style.WARNING(
+                    f'⚠️  Skipped {skipped_users} user{"s" if skipped_users != 1 else ""} - '
+                    f'OPA was saturated (try fewer --workers) or has not fetched their '
+                    f'latest group changes yet'
+                )
+            )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cms.warmup import run_warmup
+
+
+class Command(BaseCommand):
+    help = 'Preload URLs, templates, OPA connections, decisions and the public page'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict',
+            action='store_true',
+            help='Exit with an error if any warm-up step fails',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('🔥 Warming up...\n'))
+
+        failed = []
+        for name, ok, elapsed_ms, detail in run_warmup():
+            if ok:
+                self.stdout.write(
+                    self.style.SUCCESS(f'✅ {name}: {detail} ({elapsed_ms:.1f}ms)')
+                )
+            else:
+                failed.append(name)
+                self.stdout.write(
+                    self.style.WARNING(f'⚠️  {name}: {detail} ({elapsed_ms:.1f}ms)')
+                )
+
+        if failed and options['strict']:
+            raise CommandError(f'Warm-up steps failed: {", ".join(failed)}')
+
+        self.stdout.write(self.style.SUCCESS('\n🎉 Warm-up complete'))
@@ -0,0 +1,107 @@
+import logging
+import random
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from .db_router import is_pinned_to_primary, pin_after_writes
+from .timing import current_trace, span, start_trace, stop_trace
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+
+class PrimaryPinningMiddleware:
+    """Keep a client's reads on the primary for a short while after it writes.
+
+    Unsafe requests and requests carrying the pin cookie read from the primary.
+    When a request writes, the cookie is (re)issued so the redirect that
+    usually follows does not read stale data from a lagging replica.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookie_name = getattr(settings, "REPLICA_PIN_COOKIE", "cms_primary_pin")
+        self.pin_seconds = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+
+    def __call__(self, request):
+        pinned_at_start = (
+            request.method not in SAFE_METHODS or self.cookie_name in request.COOKIES
+        )
+        with pin_after_writes(pinned_at_start):
+            response = self.get_response(request)
+            wrote = request.method not in SAFE_METHODS or (
+                not pinned_at_start and is_pinned_to_primary()
+            )
+
+        if wrote and self.pin_seconds:
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=self.pin_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+def _time_query(execute, sql, params, many, context):
+    with span("db", sql[:120]):
+        return execute(sql, params, many, context)
+
+
+class ServerTimingMiddleware:
+    """Time OPA, cache, SQL and template work and report it per request.
+
+    Adds a ``Server-Timing`` header when ``CMS_SERVER_TIMING`` is on, and
+    logs the whole span tree of a ``CMS_SLOW_REQUEST_SAMPLE_RATE`` sample of
+    requests slower than ``CMS_SLOW_REQUEST_MS``. Place it first so the total
+    covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, "CMS_SERVER_TIMING", True)
+        self.slow_ms = getattr(settings, "CMS_SLOW_REQUEST_MS", None)
+        self.sample_rate = getattr(settings, "CMS_SLOW_REQUEST_SAMPLE_RATE", 1.0)
+
+    def __call__(self, request):
+        if not self.header and self.slow_ms is None:
+            return self.get_response(request)
+
+        token = start_trace(f"{request.method} {request.path}")
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            trace = stop_trace(token)
+
+        if self.header:
+            response["Server-Timing"] = trace.server_timing()
+        if (
+            self.slow_ms is not None
+            and trace.root.duration_ms >= self.slow_ms
+            and random.random() < self.sample_rate
+        ):
+            logger.warning(
+                f"Slow request {trace.root.name} ({trace.root.duration_ms:.1f}ms):\n"
+                f"{trace.format_tree()}"
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        trace = current_trace()
+        # Responses from the page cache are already rendered
+        if trace is not None and not response.is_rendered:
+            name = response.template_name
+            if isinstance(name, (list, tuple)):
+                name = name[0] if name else ""
+            template_span = trace.begin("template", str(name or ""))
+            # Rendering happens after every middleware has seen the response;
+            # the span ends in a post-render callback
+            response.add_post_render_callback(lambda response: trace.end(template_span))
+        return response
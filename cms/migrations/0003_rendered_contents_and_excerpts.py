@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0002_entry_published_at_publishedentries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='excerpt',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='publishedentries',
+            name='contents_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='publishedentries',
+            name='excerpt',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,124 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:10
+
+import cms.fields
+from django.db import migrations, models
+
+CHUNK_SIZE = 500
+
+# (model name, plain field, compressed field)
+COLUMNS = [
+    ("entry", "contents", "contents_compressed"),
+    ("publishedentries", "contents", "contents_compressed"),
+    ("publishedentries", "contents_html", "contents_html_compressed"),
+]
+
+
+def _copy_columns(apps, source_index, target_index):
+    """Copy every row's text between the plain and compressed columns"""
+    for model_name in ("entry", "publishedentries"):
+        model = apps.get_model("cms", model_name)
+        columns = [c for c in COLUMNS if c[0] == model_name]
+        sources = [c[source_index] for c in columns]
+        targets = [c[target_index] for c in columns]
+
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .only("pk", *sources)[:CHUNK_SIZE]
+            )
+            if not batch:
+                break
+            for obj in batch:
+                for source, target in zip(sources, targets):
+                    setattr(obj, target, getattr(obj, source))
+            model.objects.bulk_update(batch, targets)
+            last_pk = batch[-1].pk
+
+
+def compress_rows(apps, schema_editor):
+    _copy_columns(apps, source_index=1, target_index=2)
+
+
+def decompress_rows(apps, schema_editor):
+    _copy_columns(apps, source_index=2, target_index=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0003_rendered_contents_and_excerpts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='contents_compressed',
+            field=cms.fields.CompressedTextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='publishedentries',
+            name='contents_compressed',
+            field=cms.fields.CompressedTextField(null=True),
+        ),
+        migrations.AddField(
+            model_name='publishedentries',
+            name='contents_html_compressed',
+            field=cms.fields.CompressedTextField(null=True),
+        ),
+        # Let the plain columns be re-added empty if this migration is reversed
+        migrations.AlterField(
+            model_name='entry',
+            name='contents',
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='contents',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(compress_rows, decompress_rows),
+        migrations.RemoveField(
+            model_name='entry',
+            name='contents',
+        ),
+        migrations.RemoveField(
+            model_name='publishedentries',
+            name='contents',
+        ),
+        migrations.RemoveField(
+            model_name='publishedentries',
+            name='contents_html',
+        ),
+        migrations.RenameField(
+            model_name='entry',
+            old_name='contents_compressed',
+            new_name='contents',
+        ),
+        migrations.RenameField(
+            model_name='publishedentries',
+            old_name='contents_compressed',
+            new_name='contents',
+        ),
+        migrations.RenameField(
+            model_name='publishedentries',
+            old_name='contents_html_compressed',
+            new_name='contents_html',
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='contents',
+            field=cms.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='contents',
+            field=cms.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='contents_html',
+            field=cms.fields.CompressedTextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0004_compress_contents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PolicyDataChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Policy Data Change',
+                'verbose_name_plural': 'Policy Data Changes',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0005_policydatachange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('publish', 'Publish'), ('unpublish', 'Unpublish')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('coalesced', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Publish Event',
+                'verbose_name_plural': 'Publish Events',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='cms_publish_status_68fdb5_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('entry_id',), name='cms_publishevent_one_pending_per_entry')],
+            },
+        ),
+    ]
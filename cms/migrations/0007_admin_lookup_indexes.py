@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0006_publishevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='published_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='owner_username',
+            field=models.CharField(db_index=True, max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='published_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from cms.search import get_search_backend
+
+    backend = get_search_backend(vendor=schema_editor.connection.vendor)
+    backend.create_index(schema_editor)
+
+    PublishedEntries = apps.get_model("cms", "PublishedEntries")
+    published = PublishedEntries.objects.using(schema_editor.connection.alias)
+    last_pk = 0
+    while True:
+        batch = list(
+            published.filter(pk__gt=last_pk)
+            .only("pk", "original_entry_id", "owner_username", "contents")
+            .order_by("pk")[:500]
+        )
+        if not batch:
+            break
+        backend.index_many(
+            [(row.original_entry_id, row.owner_username, str(row.contents)) for row in batch],
+            using=schema_editor.connection.alias,
+        )
+        last_pk = batch[-1].pk
+
+
+def drop_search_index(apps, schema_editor):
+    from cms.search import get_search_backend
+
+    get_search_backend(vendor=schema_editor.connection.vendor).drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("cms", "0007_admin_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
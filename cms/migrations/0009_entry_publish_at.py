@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0008_published_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
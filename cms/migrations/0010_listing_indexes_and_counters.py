@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_entries(apps, schema_editor):
+    Entry = apps.get_model("cms", "Entry")
+    EntryCounter = apps.get_model("cms", "EntryCounter")
+    alias = schema_editor.connection.alias
+    rows = (
+        Entry.objects.using(alias).values_list("owner_id")
+        .annotate(entries=Count("pk"), published=Count("published_at")).order_by()
+    )
+    counters = [
+        EntryCounter(owner_id=owner_id, entries=entries, published=published)
+        for owner_id, entries, published in rows
+    ]
+    # Site-wide totals live under owner 0
+    counters.append(EntryCounter(
+        owner_id=0,
+        entries=sum(counter.entries for counter in counters),
+        published=sum(counter.published for counter in counters),
+    ))
+    EntryCounter.objects.using(alias).bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0009_entry_publish_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner_id', models.BigIntegerField(unique=True)),
+                ('entries', models.BigIntegerField(default=0)),
+                ('published', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Entry Counter',
+                'verbose_name_plural': 'Entry Counters',
+            },
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='published_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='publishedentries',
+            name='owner_username',
+            field=models.CharField(max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(fields=['owner', '-created_at'], name='cms_entry_owner_created'),
+        ),
+        migrations.AddIndex(
+            model_name='entry',
+            index=models.Index(condition=models.Q(('published_at__isnull', False)), fields=['-published_at'], name='cms_entry_published'),
+        ),
+        migrations.AddIndex(
+            model_name='publishedentries',
+            index=models.Index(fields=['owner_username', '-published_at'], name='cms_published_owner_date'),
+        ),
+        migrations.RunPython(count_entries, migrations.RunPython.noop),
+    ]
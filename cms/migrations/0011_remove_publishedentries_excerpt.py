@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0010_listing_indexes_and_counters'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='publishedentries',
+            name='excerpt',
+        ),
+    ]
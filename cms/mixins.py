@@ -8,6 +8,9 @@ class OPAPermissionMixin:
     """Mixin to check OPA permissions for views"""
     required_permission = None
     resource_type = None
+    # Set when the decision cannot depend on the user; OPA is then asked to
+    # prove that once per policy revision instead of on every request
+    user_independent_policy = False
     
     def dispatch(self, request, *args, **kwargs):
         if not self.check_opa_permission(request):
@@ -21,6 +24,13 @@ class OPAPermissionMixin:
     def check_opa_permission(self, request):
         if not self.required_permission or not self.resource_type:
             return True  # No permission check required
+
+        if self.user_independent_policy:
+            decision = opa_client.user_independent_decision(
+                self.required_permission, self.resource_type
+            )
+            if decision is not None:
+                return decision
         
         resource_data = self.get_resource_data(request)
         
@@ -1,47 +1,114 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .fields import CompressedTextField
+from .rendering import make_excerpt, render_contents
+
 
 class Entry(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(null=True, blank=True)
+    # Scheduled publication, picked up by the publish_scheduled command
+    publish_at = models.DateTimeField(null=True, blank=True, db_index=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
-    contents = models.TextField()
+    contents = CompressedTextField()
+    excerpt = models.TextField(blank=True, default="", editable=False)
 
     def __str__(self):
         return f"Entry by {self.owner.username} - {self.created_at.strftime('%Y-%m-%d')}"
 
+    def save(self, *args, **kwargs):
+        # Keep the listing excerpt in step with the contents (unless they
+        # were deferred or never read, and so cannot have changed)
+        if isinstance(self.__dict__.get("contents"), str):
+            self.excerpt = make_excerpt(self.contents)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "contents" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "excerpt"}
+        super().save(*args, **kwargs)
+
     def is_published(self):
         return self.published_at is not None
 
     def publish(self):
         """Publish this entry and create/update a PublishedEntries record"""
-        self.published_at = timezone.now()
-        self.save()
-
-        # Create or update the published version
-        PublishedEntries.objects.update_or_create(
-            original_entry=self,
-            defaults={
-                "owner_username": self.owner.username,
-                "contents": self.contents,
-                "created_at": self.created_at,
-                "updated_at": self.updated_at,
-                "published_at": self.published_at,
-            },
-        )
+        from .counters import adjust_one
+        from .page_cache import bump_page_generation
+        from .pipeline import enqueue_publish_event
+        from .search import index_published_entry
+
+        with transaction.atomic():
+            now = timezone.now()
+            # Decided by the row, not this instance: of two racing publishes
+            # (a double-clicked button) only one finds it unpublished
+            newly_published = Entry.objects.filter(
+                pk=self.pk, published_at__isnull=True
+            ).update(published_at=now)
+            if newly_published:
+                adjust_one(self.owner_id, published=1)
+            self.published_at = now
+            # Publishing now supersedes any schedule
+            self.publish_at = None
+            self.save()
+
+            # Create or update the published version
+            PublishedEntries.objects.update_or_create(
+                original_entry=self,
+                defaults={
+                    "owner_username": self.owner.username,
+                    "contents": self.contents,
+                    "contents_html": render_contents(self.contents),
+                    "created_at": self.created_at,
+                    "updated_at": self.updated_at,
+                    "published_at": self.published_at,
+                },
+            )
+            index_published_entry(self)
+            transaction.on_commit(bump_page_generation)
+            # Side effects run later in the publish worker
+            enqueue_publish_event(self.pk, PublishEvent.PUBLISH)
+
+    def schedule_publish(self, when):
+        """Publish this entry at ``when`` (see the publish_scheduled command)"""
+        self.publish_at = when
+        self.save(update_fields=["publish_at", "updated_at"])
 
     def unpublish(self):
-        PublishedEntries.objects.filter(
-            original_entry=self,
-        ).delete()
-        self.published_at = None
-        self.save()
+        from .counters import adjust_one
+        from .page_cache import bump_page_generation
+        from .pipeline import enqueue_publish_event
+        from .search import remove_from_index
+
+        with transaction.atomic():
+            PublishedEntries.objects.filter(
+                original_entry=self,
+            ).delete()
+            remove_from_index([self.pk])
+            transaction.on_commit(bump_page_generation)
+            was_published = Entry.objects.filter(
+                pk=self.pk, published_at__isnull=False
+            ).update(published_at=None)
+            if was_published:
+                adjust_one(self.owner_id, published=-1)
+            self.published_at = None
+            self.save()
+            enqueue_publish_event(self.pk, PublishEvent.UNPUBLISH)
 
     class Meta:
         verbose_name_plural = "entries"
+        indexes = [
+            # "My entries" and the admin owner filter, newest first
+            models.Index(fields=["owner", "-created_at"], name="cms_entry_owner_created"),
+            # Published entries by publication date (admin filter); drafts
+            # are left out of the index
+            models.Index(
+                fields=["-published_at"],
+                name="cms_entry_published",
+                condition=models.Q(published_at__isnull=False),
+            ),
+        ]
 
 
 class PublishedEntries(models.Model):
@@ -49,10 +116,12 @@ class PublishedEntries(models.Model):
         Entry, on_delete=models.CASCADE, related_name="published_version"
     )
     owner_username = models.CharField(max_length=150)
-    contents = models.TextField()
+    contents = CompressedTextField()
+    # Pre-rendered at publish time so listings never re-render full articles
+    contents_html = CompressedTextField(blank=True, default="")
     created_at = models.DateTimeField()
     updated_at = models.DateTimeField()
-    published_at = models.DateTimeField()
+    published_at = models.DateTimeField(db_index=True)
 
     def __str__(self):
         return f"Published: {self.owner_username} - {self.published_at.strftime('%Y-%m-%d')}"
@@ -61,3 +130,99 @@ class PublishedEntries(models.Model):
         verbose_name = "Published Entry"
         verbose_name_plural = "Published Entries"
         ordering = ["-published_at"]
+        indexes = [
+            # Admin username filter in listing order; also serves lookups
+            # by username alone
+            models.Index(
+                fields=["owner_username", "-published_at"],
+                name="cms_published_owner_date",
+            ),
+        ]
+
+
+class EntryCounter(models.Model):
+    """Entry and published-entry counts of one owner, maintained by the
+    publish path (see cms.counters) so listings need not ``COUNT(*)``.
+
+    The row with ``owner_id`` 0 holds the site-wide totals.
+    """
+
+    # Not a foreign key: owner 0 is the site-wide row
+    owner_id = models.BigIntegerField(unique=True)
+    entries = models.BigIntegerField(default=0)
+    published = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        owner = f"owner {self.owner_id}" if self.owner_id else "all owners"
+        return f"{self.entries} entries, {self.published} published ({owner})"
+
+    class Meta:
+        verbose_name = "Entry Counter"
+        verbose_name_plural = "Entry Counters"
+
+
+class PolicyDataChange(models.Model):
+    """A change to a user's policy data (groups, staff or active flag).
+
+    The newest id is part of the OPA bundle revision, and the rows since a
+    client's revision tell the bundle server which users a delta must cover.
+    """
+
+    user_id = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Policy data change #{self.pk} for user {self.user_id}"
+
+    class Meta:
+        verbose_name = "Policy Data Change"
+        verbose_name_plural = "Policy Data Changes"
+
+
+class PublishEvent(models.Model):
+    """A queued post-publish job, processed by the run_publish_worker command.
+
+    Only one pending event exists per entry: repeated publishes/unpublishes
+    before the worker picks it up are merged into it.
+    """
+
+    PUBLISH = "publish"
+    UNPUBLISH = "unpublish"
+    KIND_CHOICES = [(PUBLISH, "Publish"), (UNPUBLISH, "Unpublish")]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # Not a foreign key: the job must survive the entry being deleted
+    entry_id = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    coalesced = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.kind} entry {self.entry_id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Publish Event"
+        verbose_name_plural = "Publish Events"
+        indexes = [models.Index(fields=["status", "available_at"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["entry_id"],
+                condition=models.Q(status="pending"),
+                name="cms_publishevent_one_pending_per_entry",
+            )
+        ]
@@ -1,83 +1,513 @@
+import hashlib
 import httpx
 import json
+import math
+import random
+import threading
+import time
 from django.conf import settings
 from django.core.cache import cache
 import logging
 from typing import Dict, Any, Optional
 
+from .timing import span
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, json is always available
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
-class OPAClient:
+
+def dumps(data: Any) -> bytes:
+    """Canonical JSON bytes: sorted keys, no whitespace, UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Every action/resource pair used by cms_authz.rego; warmed in one batch query
+POLICY_ACTIONS = ["list", "view", "create", "edit", "delete", "publish", "unpublish", "moderate"]
+POLICY_RESOURCES = ["entry", "entries", "published_entries"]
+DECISION_MATRIX = [
+    (action, resource) for action in POLICY_ACTIONS for resource in POLICY_RESOURCES
+]
+ADMISSION_METRICS = [
+    "admitted",
+    "rejected_queue_full",
+    "rejected_queue_timeout",
+    "shed_stale",
+    "shed_fallback",
+]
+
+class _Flight:
+    """An OPA query in progress that concurrent callers wait on"""
+
     def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class _Admission:
+    """Bounded concurrency for OPA calls with a bounded, time-limited queue.
+
+    At most ``limit`` calls run at once; up to ``max_queue`` more wait for a
+    slot for at most ``queue_timeout`` seconds. Anything beyond that is
+    rejected right away so callers can shed load instead of piling up.
+    """
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> Optional[str]:
+        """Take a slot; returns None when admitted, else why it was rejected"""
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.max_queue:
+                    return "queue_full"
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self.active < self.limit, self.queue_timeout
+                    )
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    return "queue_timeout"
+            self.active += 1
+            return None
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class OPAClient:
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None):
         self.opa_url = getattr(settings, 'OPA_URL', 'http://localhost:8181')
         self.policy_path = getattr(settings, 'OPA_POLICY_PATH', 'cms/authz')
         self.cache_timeout = getattr(settings, 'OPA_CACHE_TIMEOUT', 300)  # 5 minutes
         self.timeout = getattr(settings, 'OPA_TIMEOUT', 5.0)
+        # OPA gets groups/staff from the Django-served bundle (data.users)
+        self.use_bundle_data = getattr(settings, 'OPA_USE_BUNDLE_DATA', False)
+        # Custom httpx transport, e.g. a local stand-in for OPA in tests
+        self.transport = transport
+        # Talk to a co-located OPA over a Unix socket; OPA_URL then only
+        # supplies the Host header
+        self.unix_socket = getattr(settings, 'OPA_UNIX_SOCKET', None)
+        # Spread expiry of decisions cached at the same moment
+        self.cache_jitter = getattr(settings, 'OPA_CACHE_JITTER', 0.1)
+        # XFetch beta: >1 refreshes hot keys earlier, 0 disables early refresh
+        self.early_refresh_beta = getattr(settings, 'OPA_EARLY_REFRESH_BETA', 1.0)
+        # Also deduplicate across processes with a lock in the cache backend
+        self.cross_process_lock = getattr(settings, 'OPA_SINGLE_FLIGHT_LOCK', False)
+        self.lock_wait = getattr(settings, 'OPA_SINGLE_FLIGHT_LOCK_WAIT', 0.5)
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self.max_connections = getattr(settings, 'OPA_MAX_CONNECTIONS', 20)
+        self._http: Optional[httpx.Client] = None
+        self._http_config = None
+        self._http_lock = threading.Lock()
+        # Admission control: concurrent OPA calls, callers allowed to wait
+        # for a slot, and how long they may wait before load is shed
+        self.max_concurrency = getattr(settings, 'OPA_MAX_CONCURRENCY', None)
+        self._admission = _Admission(
+            self.max_concurrency,
+            getattr(settings, 'OPA_MAX_QUEUE', 50),
+            getattr(settings, 'OPA_QUEUE_TIMEOUT', 0.25),
+        ) if self.max_concurrency else None
+        # Expired decisions stay cached this much longer, to be served when
+        # OPA is overloaded
+        self.stale_ttl = getattr(settings, 'OPA_STALE_TTL', 300)
+        self._metrics = dict.fromkeys(ADMISSION_METRICS, 0)
+        self._metrics_lock = threading.Lock()
     
+    def _cache_key(self, input_data: Dict[str, Any], encoded: Optional[bytes] = None) -> str:
+        """Cache key for a decision; stable across processes, unlike hash().
+        Pass ``encoded`` when the input was already serialized with dumps()"""
+        if encoded is None:
+            encoded = dumps(input_data)
+        return f"opa_{hashlib.sha256(encoded).hexdigest()}"
+
+    def _http_client(self) -> httpx.Client:
+        """Shared client, so OPA connections are pooled and kept alive"""
+        config = (self.opa_url, self.transport, self.unix_socket)
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections,
+        )
+        with self._http_lock:
+            if self._http is None or self._http_config != config:
+                if self._http is not None:
+                    self._http.close()
+                transport = self.transport
+                if transport is None and self.unix_socket:
+                    # A custom transport brings its own pool limits
+                    transport = httpx.HTTPTransport(uds=self.unix_socket, limits=limits)
+                self._http = httpx.Client(
+                    base_url=self.opa_url,
+                    timeout=self.timeout,
+                    transport=transport,
+                    limits=limits,
+                )
+                self._http_config = config
+            return self._http
+
+    def _post_json(self, path: str, body: bytes) -> Dict[str, Any]:
+        response = self._http_client().post(
+            path, content=body, headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content) if orjson is not None else response.json()
+        return result.get('result', {})
+
+    def _post_query(self, input_data: Dict[str, Any], encoded: Optional[bytes] = None) -> Dict[str, Any]:
+        """Send a query to OPA and return its result document. The body wraps
+        ``encoded`` (the input from dumps()) as is, without serializing again"""
+        if encoded is None:
+            encoded = dumps(input_data)
+        with span("opa", f"{input_data.get('action')}:{input_data.get('resource')}"):
+            return self._post_json(
+                f"/v1/data/{self.policy_path}", b'{"input":' + encoded + b'}'
+            )
+
+    def _post_compile(self, query: str, input_data: Dict[str, Any], unknowns: list) -> Dict[str, Any]:
+        """Partially evaluate ``query`` with ``unknowns`` left open"""
+        with span("opa", "compile"):
+            return self._post_json(
+                "/v1/compile",
+                dumps({"query": query, "input": input_data, "unknowns": unknowns}),
+            )
+
+    def prime_connections(self, count: int = 1) -> int:
+        """Open up to ``count`` pooled connections to OPA via its health
+        endpoint; returns how many health checks succeeded"""
+        client = self._http_client()
+        results = []
+
+        def check():
+            try:
+                results.append(client.get("/health").status_code == 200)
+            except httpx.HTTPError as e:
+                logger.warning(f"OPA health check failed: {e}")
+                results.append(False)
+
+        # Concurrent requests are needed to open more than one connection
+        threads = [threading.Thread(target=check) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(results)
+
+    def _jittered_ttl(self) -> float:
+        return self.cache_timeout * (1 - random.uniform(0, self.cache_jitter))
+
+    def _cache_entry(self, result: Dict[str, Any], compute_time: float, ttl: float) -> Dict[str, Any]:
+        """Cached form of a decision, with what early refresh needs"""
+        return {"result": result, "expires": time.time() + ttl, "delta": compute_time}
+
+    def _cache_result(self, cache_key: str, result: Dict[str, Any], compute_time: float):
+        ttl = self._jittered_ttl()
+        cache.set(cache_key, self._cache_entry(result, compute_time, ttl), ttl + self.stale_ttl)
+
+    def _opa_has_user_data(self, input_data: Dict[str, Any]) -> bool:
+        """False while the user's latest policy data change is newer than the
+        bundle OPA last fetched, i.e. OPA may still answer from old data"""
+        data_version = input_data.get("user", {}).get("data_version")
+        if not data_version:
+            return True
+        from .bundle import served_change_id
+        return data_version <= served_change_id()
+
+    def _should_refresh_early(self, entry: Dict[str, Any]) -> bool:
+        """XFetch: refresh before expiry with a probability that grows as
+        expiry nears, so hot keys are renewed by one caller, not all at once"""
+        if not self.early_refresh_beta:
+            return False
+        gap = -entry["delta"] * self.early_refresh_beta * math.log(1 - random.random())
+        return time.time() + gap >= entry["expires"]
+
     def query_policy(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """Query OPA for authorization decision"""
-        cache_key = f"opa_{hash(json.dumps(input_data, sort_keys=True))}"
+        # Serialized once: hashed for the cache key, sent as the request body
+        encoded = dumps(input_data)
+        cache_key = self._cache_key(input_data, encoded)
         
         # Check cache first
-        cached_result = cache.get(cache_key)
-        if cached_result is not None:
-            logger.debug(f"OPA cache hit for key: {cache_key}")
-            return cached_result
-        
+        with span("cache", "opa decision"):
+            entry = cache.get(cache_key)
+        stale = None
+        if entry is not None:
+            if time.time() < entry["expires"]:
+                if not self._should_refresh_early(entry):
+                    logger.debug(f"OPA cache hit for key: {cache_key}")
+                    return entry["result"]
+                logger.debug(f"OPA early refresh for key: {cache_key}")
+                return self._single_flight(cache_key, input_data, encoded, current=entry["result"])
+            # Expired: only kept to answer with if OPA is overloaded
+            stale = entry["result"]
+
+        return self._single_flight(cache_key, input_data, encoded, stale=stale)
+
+    def _single_flight(self, cache_key: str, input_data: Dict[str, Any], encoded: bytes, current: Optional[Dict[str, Any]] = None, stale: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Let one caller per key query OPA while concurrent callers share its
+        result (or keep using ``current`` during an early refresh)"""
+        with self._flights_lock:
+            flight = self._flights.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[cache_key] = _Flight()
+
+        if not leader:
+            if current is not None:
+                return current
+            flight.done.wait(self.timeout + self.lock_wait)
+            return flight.result if flight.result is not None else self._fallback_policy()
+
         try:
-            url = f"{self.opa_url}/v1/data/{self.policy_path}"
+            shed_to = current if current is not None else stale
+            flight.result = self._fetch_with_lock(cache_key, input_data, encoded, current, shed_to)
+            return flight.result
+        finally:
+            with self._flights_lock:
+                del self._flights[cache_key]
+            flight.done.set()
+
+    def _fetch_with_lock(self, cache_key: str, input_data: Dict[str, Any], encoded: bytes, current: Optional[Dict[str, Any]], shed_to: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if not self.cross_process_lock:
+            return self._fetch(cache_key, input_data, encoded, shed_to)
+
+        lock_key = f"{cache_key}_lock"
+        if not cache.add(lock_key, 1, self.timeout + 1):
+            # Another process is querying OPA for this key
+            if current is not None:
+                return current
+            deadline = time.monotonic() + self.lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.01)
+                entry = cache.get(cache_key)
+                if entry is not None and time.time() < entry["expires"]:
+                    return entry["result"]
+            return self._fetch(cache_key, input_data, encoded, shed_to)
+
+        try:
+            return self._fetch(cache_key, input_data, encoded, shed_to)
+        finally:
+            cache.delete(lock_key)
+
+    def _fetch(self, cache_key: str, input_data: Dict[str, Any], encoded: bytes, shed_to: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        rejected = self._admit()
+        if rejected:
+            return self._shed(rejected, input_data, shed_to)
+        try:
+            return self._fetch_admitted(cache_key, input_data, encoded, shed_to)
+        finally:
+            self._release()
+
+    def _admit(self) -> Optional[str]:
+        if self._admission is None:
+            return None
+        with span("opa", "queue"):
+            rejected = self._admission.acquire()
+        self._incr_metric(f"rejected_{rejected}" if rejected else "admitted")
+        return rejected
+
+    def _release(self):
+        if self._admission is not None:
+            self._admission.release()
+
+    def _shed(self, reason: str, input_data: Dict[str, Any], stale: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Answer without OPA: the last known decision if any, else the fallback"""
+        what = f"{input_data.get('action')}:{input_data.get('resource')}"
+        if stale is not None:
+            self._incr_metric("shed_stale")
+            logger.warning(f"OPA overloaded ({reason}), serving stale decision for {what}")
+            return stale
+        self._incr_metric("shed_fallback")
+        logger.warning(f"OPA overloaded ({reason}), using fallback policy for {what}")
+        return self._fallback_policy()
+
+    def _incr_metric(self, name: str):
+        with self._metrics_lock:
+            self._metrics[name] += 1
+
+    def admission_metrics(self) -> Dict[str, Any]:
+        """Counters since start plus current queue state, for this process"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        admission = self._admission
+        metrics.update({
+            "max_concurrency": self.max_concurrency,
+            "active": admission.active if admission else 0,
+            "queue_depth": admission.waiting if admission else 0,
+            "max_queue_depth": admission.max_waiting if admission else 0,
+        })
+        return metrics
+
+    def _fetch_admitted(self, cache_key: str, input_data: Dict[str, Any], encoded: bytes, fall_back_to: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Query OPA and cache the answer. On failure answer with
+        ``fall_back_to`` (the decision being refreshed, or an expired one)
+        if there is one, so a refresh never makes the result worse."""
+        try:
+            start = time.monotonic()
+            result = self._post_query(input_data, encoded)
             
-            with httpx.Client(timeout=self.timeout) as client:
-                response = client.post(
-                    url, 
-                    json={"input": input_data}
-                )
-                response.raise_for_status()
-                
-                result = response.json().get('result', {})
-                
-                # Cache the result
-                cache.set(cache_key, result, self.cache_timeout)
+            # Cache the result
+            if self._opa_has_user_data(input_data):
+                self._cache_result(cache_key, result, time.monotonic() - start)
                 logger.debug(f"OPA policy query successful, cached result for key: {cache_key}")
-                
-                return result
-                
+            
+            return result
+            
         except httpx.RequestError as e:
             logger.error(f"OPA query failed - network error: {e}")
-            return self._fallback_policy()
         except httpx.HTTPStatusError as e:
             logger.error(f"OPA query failed - HTTP {e.response.status_code}: {e}")
-            return self._fallback_policy()
         except Exception as e:
             logger.error(f"OPA query failed - unexpected error: {e}")
-            return self._fallback_policy()
+        if fall_back_to is not None:
+            return fall_back_to
+        return self._fallback_policy()
     
     def _fallback_policy(self) -> Dict[str, Any]:
         """Fallback to restrictive policy when OPA is unavailable"""
         return {"allow": False, "permissions": ["view_published"]}
     
-    def check_permission(self, user, action: str, resource: str, resource_data: Optional[Dict[str, Any]] = None) -> bool:
-        """Check if user has permission for specific action on resource"""
-        input_data = {
-            "user": self._serialize_user(user),
+    def _permission_input(self, user_data: Dict[str, Any], action: str, resource: str, resource_data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "user": user_data,
             "action": action,
             "resource": resource,
             "resource_data": resource_data or {}
         }
+
+    def _user_permissions_input(self, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "user": user_data,
+            "action": "get_permissions",
+            "resource": "user_permissions"
+        }
+
+    def check_permission(self, user, action: str, resource: str, resource_data: Optional[Dict[str, Any]] = None) -> bool:
+        """Check if user has permission for specific action on resource"""
+        input_data = self._permission_input(
+            self._serialize_user(user), action, resource, resource_data
+        )
         
         result = self.query_policy(input_data)
         return result.get("allow", False)
     
+    def user_independent_decision(self, action: str, resource: str) -> Optional[bool]:
+        """The allow decision for action/resource if it is the same for every
+        user and resource, else None.
+
+        OPA partially evaluates the allow rule with the user, their bundle
+        data and the resource data unknown: no remaining queries means never
+        allowed, an empty query means always allowed. The answer is cached
+        per policy digest, so a policy change is re-checked.
+        """
+        from .bundle import policy_digest
+
+        try:
+            digest = policy_digest()
+        except OSError as e:
+            logger.debug(f"No local policy file to key static decisions on: {e}")
+            return None
+
+        cache_key = f"opa_static_{digest}_{action}_{resource}"
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached["decision"]
+
+        try:
+            result = self._post_compile(
+                f"data.{self.policy_path.replace('/', '.')}.allow == true",
+                {"action": action, "resource": resource},
+                ["input.user", "input.resource_data", "data.users"],
+            )
+        except Exception as e:
+            logger.warning(f"OPA partial evaluation failed for {action}:{resource}: {e}")
+            return None
+
+        queries = result.get("queries") or []
+        if not queries:
+            decision = False
+        elif any(len(query) == 0 for query in queries):
+            decision = True
+        else:
+            decision = None
+        cache.set(cache_key, {"decision": decision}, self.cache_timeout)
+        return decision
+
     def get_user_permissions(self, user) -> list:
         """Get all permissions for a user"""
-        input_data = {
-            "user": self._serialize_user(user),
-            "action": "get_permissions",
-            "resource": "user_permissions"
-        }
+        input_data = self._user_permissions_input(self._serialize_user(user))
         
         result = self.query_policy(input_data)
         return result.get("permissions", ["view_published"])
+
+    def warm_user_decisions(self, user) -> Optional[int]:
+        """Cache every DECISION_MATRIX decision for a user with one OPA query.
+
+        Each decision is stored under the same key that check_permission and
+        get_user_permissions would use, so the user's first requests hit the
+        cache. Returns the number of cached decisions, 0 if OPA failed, or
+        None if the user was skipped without asking OPA.
+        """
+        user_data = self._serialize_user(user)
+        if not self._opa_has_user_data({"user": user_data}):
+            # OPA's answers would not reflect the user's latest change yet
+            return None
+        inputs = [
+            self._permission_input(user_data, action, resource)
+            for action, resource in DECISION_MATRIX
+        ]
+        inputs.append(self._user_permissions_input(user_data))
+
+        batch_input = {
+            "user": user_data,
+            "action": "batch",
+            "resource": "decisions",
+            "batch": [
+                {key: value for key, value in item.items() if key != "user"}
+                for item in inputs
+            ],
+        }
+
+        if self._admit():
+            # Warm-up is optional work; drop it when OPA is saturated
+            return None
+        try:
+            start = time.monotonic()
+            decisions = self._post_query(batch_input).get("decisions", {})
+            elapsed = time.monotonic() - start
+        except Exception as e:
+            logger.error(f"OPA warm-up failed for user {user_data['username']}: {e}")
+            return 0
+        finally:
+            self._release()
+
+        # Warmed keys share one TTL; early refresh spreads out their renewal
+        to_cache = {}
+        ttl = self._jittered_ttl()
+        for item in inputs:
+            decision = decisions.get(f"{item['action']}:{item['resource']}")
+            if decision is not None:
+                to_cache[self._cache_key(item)] = self._cache_entry(decision, elapsed, ttl)
+
+        cache.set_many(to_cache, ttl + self.stale_ttl)
+        logger.debug(f"Warmed {len(to_cache)} OPA decisions for user {user_data['username']}")
+        return len(to_cache)
     
     def _serialize_user(self, user) -> Dict[str, Any]:
         """Serialize user data for OPA input"""
@@ -90,6 +520,19 @@ class OPAClient:
                 "groups": [],
             }
         
+        if self.use_bundle_data:
+            # Only identify the user; no group queries on the request path.
+            # The latest change id versions the user's cached decisions
+            from .bundle import user_change_id
+            return {
+                "id": user.id if user.is_authenticated else None,
+                "username": user.username
+                if user.is_authenticated
+                else "anonymous",
+                "is_authenticated": user.is_authenticated,
+                "data_version": user_change_id(user.id) if user.is_authenticated else 0,
+            }
+
         return {
             "id": user.id if user.is_authenticated else None,
             "username": user.username
@@ -104,6 +547,10 @@ class OPAClient:
 
     def _get_user_groups(self, user) -> list:
         """Get user Django groups"""
+        cached = getattr(user, "_cms_group_names", None)
+        if cached is not None:
+            # Loaded with the user by cms.backends.CachedModelBackend
+            return [name.lower() for name in cached]
         try:
             if hasattr(user, "groups") and user.groups.exists():
                 return [group.name.lower() for group in user.groups.all()]
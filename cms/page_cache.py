@@ -0,0 +1,106 @@
+import functools
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .bundle import policy_digest
+from .timing import span
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "cms_page_generation"
+
+# The only query parameters the cached views read; anything else (tracking
+# tags, cache busters) would just fill the cache with copies
+KEY_PARAMS = ("page", "q")
+
+
+def page_cache():
+    """The cache holding whole pages, kept apart from sessions, users and
+    OPA decisions so a crawl cannot evict them"""
+    return caches[getattr(settings, "CMS_PAGE_CACHE_ALIAS", "default")]
+
+
+def page_generation() -> int:
+    """Current generation, kept next to the pages it versions. If it was
+    evicted it restarts from the clock, never from a value older pages
+    were stored under."""
+    cache = page_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY, 0)
+    return generation
+
+
+def bump_page_generation():
+    """Make every cached public page stale (published content changed)"""
+    try:
+        page_cache().incr(GENERATION_KEY)
+    except ValueError:
+        page_generation()
+        page_cache().incr(GENERATION_KEY)
+
+
+def _page_key(request) -> str:
+    try:
+        digest = policy_digest()
+    except OSError:
+        digest = "nopolicy"
+    params = [(name, request.GET.get(name, "")) for name in KEY_PARAMS]
+    path = hashlib.sha256(repr((request.path, params)).encode()).hexdigest()
+    return f"cms_page_{digest}_{page_generation()}_{request.method}_{path}"
+
+
+def _cacheable(request, response) -> bool:
+    cache_control = response.get("Cache-Control", "")
+    return (
+        response.status_code == 200
+        and not response.cookies
+        and not response.streaming
+        # A page that rendered {% csrf_token %} must send its own cookie
+        and not request.META.get("CSRF_COOKIE_NEEDS_UPDATE")
+        and "private" not in cache_control
+        and "no-store" not in cache_control
+    )
+
+
+def anonymous_page_cache(view):
+    """Cache a view's full response for anonymous GET/HEAD requests.
+
+    Pages are keyed by path and the ``KEY_PARAMS`` query parameters, the
+    policy digest and a
+    generation that publishing/unpublishing bumps, so a policy change or new
+    content is served straight away. Authenticated users always reach the
+    view.
+    """
+
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        with span("cache", "page"):
+            key = _page_key(request)
+            response = page_cache().get(key)
+        if response is not None:
+            logger.debug(f"Page cache hit for {request.path}")
+            return response
+
+        response = view(request, *args, **kwargs)
+        timeout = getattr(settings, "CMS_PAGE_CACHE_TIMEOUT", 60)
+
+        def store(response):
+            if _cacheable(request, response):
+                page_cache().set(key, response, timeout)
+
+        if hasattr(response, "render") and not response.is_rendered:
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
+
+    return wrapped
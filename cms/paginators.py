@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_count(queryset):
+    """Planner estimate of an unfiltered queryset's row count, or None.
+
+    Only PostgreSQL and MySQL keep a cheap estimate; elsewhere, and for
+    filtered querysets, callers have to count.
+    """
+    if queryset.query.where or queryset.query.distinct:
+        return None
+
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass"
+        params = [connection.ops.quote_name(table)]
+    elif connection.vendor == "mysql":
+        sql = (
+            "SELECT table_rows FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name = %s"
+        )
+        params = [table]
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    # reltuples is -1 for tables that were never analyzed
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def maintained_count(queryset):
+    """Exact count of all entries or all published entries, read from the
+    counters the publish path maintains (cms.counters), or None."""
+    from .counters import counts
+    from .models import Entry, PublishedEntries
+
+    if queryset.query.where or queryset.query.distinct:
+        return None
+    if queryset.model is Entry:
+        return counts()[0]
+    if queryset.model is PublishedEntries:
+        return counts()[1]
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that avoids ``COUNT(*)`` over large tables.
+
+    Unfiltered entry and published entry lists take their count from the
+    maintained counters. For other unfiltered lists, ``COUNT(*)`` over
+    millions of rows is a full scan on PostgreSQL, so when the planner's
+    estimate is above ``CMS_ADMIN_ESTIMATE_THRESHOLD`` the estimate is used
+    instead. Small tables and filtered lists are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        threshold = getattr(settings, "CMS_ADMIN_ESTIMATE_THRESHOLD", 100000)
+        estimate = None
+        if hasattr(self.object_list, "query"):
+            maintained = maintained_count(self.object_list)
+            if maintained is not None:
+                return maintained
+            estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= threshold:
+            return estimate
+        return super().count
@@ -0,0 +1,189 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Entry, PublishEvent
+
+logger = logging.getLogger(__name__)
+
+_handlers = []
+
+
+def register_handler(handler):
+    """Register ``handler(event, entry)`` to run after publish/unpublish.
+
+    ``entry`` is None if the entry was deleted before the event ran.
+    Handlers must be idempotent: a failed event is retried as a whole.
+    """
+    if handler not in _handlers:
+        _handlers.append(handler)
+    return handler
+
+
+def get_handlers() -> list:
+    configured = [
+        import_string(path) for path in getattr(settings, "CMS_POST_PUBLISH_HANDLERS", [])
+    ]
+    return configured + [handler for handler in _handlers if handler not in configured]
+
+
+def get_metrics() -> dict:
+    """Counts read from the PublishEvent table, so every process reports the
+    same numbers. Done events count until ``purge_finished`` deletes them."""
+    totals = PublishEvent.objects.aggregate(
+        enqueued=Count("id"),
+        coalesced=Sum("coalesced"),
+        retried=Sum(F("attempts") - 1, filter=Q(attempts__gt=1)),
+    )
+    metrics = {name: value or 0 for name, value in totals.items()}
+    depth = dict(
+        PublishEvent.objects.values_list("status").annotate(count=Count("id"))
+    )
+    for status, _ in PublishEvent.STATUS_CHOICES:
+        metrics[f"queue_{status}"] = depth.get(status, 0)
+    return metrics
+
+
+def enqueue_publish_event(entry_id, kind):
+    """Queue post-publish work, merging into the entry's pending event if any.
+
+    Call inside the transaction that changes the entry so the event is only
+    visible once the state change commits.
+    """
+    now = timezone.now()
+    merged = PublishEvent.objects.filter(
+        entry_id=entry_id, status=PublishEvent.PENDING
+    ).update(kind=kind, coalesced=F("coalesced") + 1, available_at=now, updated_at=now)
+
+    if not merged:
+        try:
+            with transaction.atomic():
+                PublishEvent.objects.create(entry_id=entry_id, kind=kind)
+        except IntegrityError:
+            # Another request queued one first; merge into it instead
+            PublishEvent.objects.filter(
+                entry_id=entry_id, status=PublishEvent.PENDING
+            ).update(kind=kind, coalesced=F("coalesced") + 1, available_at=now, updated_at=now)
+
+
+def enqueue_publish_events(entry_ids, kind):
+    """Bulk form of ``enqueue_publish_event`` for batch publishing"""
+    entry_ids = set(entry_ids)
+    if not entry_ids:
+        return
+    now = timezone.now()
+    pending = PublishEvent.objects.filter(entry_id__in=entry_ids, status=PublishEvent.PENDING)
+    merged_ids = set(pending.values_list("entry_id", flat=True))
+    pending.update(kind=kind, coalesced=F("coalesced") + 1, available_at=now, updated_at=now)
+    # A pending event queued concurrently is left as is; it redoes the same work
+    PublishEvent.objects.bulk_create(
+        [PublishEvent(entry_id=entry_id, kind=kind) for entry_id in entry_ids - merged_ids],
+        ignore_conflicts=True,
+    )
+
+
+def claim_events(batch_size) -> list:
+    """Lock a batch of due events and mark them running"""
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, "CMS_PIPELINE_LEASE_SECONDS", 300))
+
+    with transaction.atomic():
+        # Requeue events left running by a worker that died mid-batch, unless
+        # a newer pending event for the same entry will redo the work anyway
+        stale = PublishEvent.objects.filter(
+            status=PublishEvent.RUNNING, updated_at__lt=now - lease
+        )
+        pending_entries = PublishEvent.objects.filter(
+            status=PublishEvent.PENDING
+        ).values("entry_id")
+        stale.filter(entry_id__in=pending_entries).update(
+            status=PublishEvent.DONE, updated_at=now
+        )
+        # Only one event per entry may be pending: requeue the newest stale
+        # one, the older ones' work is redone by it
+        newest = stale.values("entry_id").annotate(newest=Max("pk")).values("newest")
+        stale.exclude(pk__in=newest).update(status=PublishEvent.DONE, updated_at=now)
+        for event_id in list(stale.values_list("pk", flat=True)):
+            try:
+                with transaction.atomic():
+                    PublishEvent.objects.filter(pk=event_id).update(
+                        status=PublishEvent.PENDING, updated_at=now
+                    )
+            except IntegrityError:
+                # An event for the entry was queued meanwhile
+                PublishEvent.objects.filter(pk=event_id).update(
+                    status=PublishEvent.DONE, updated_at=now
+                )
+
+        events = list(
+            PublishEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=PublishEvent.PENDING, available_at__lte=now)
+            .order_by("available_at")[:batch_size]
+        )
+        PublishEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            status=PublishEvent.RUNNING, attempts=F("attempts") + 1, updated_at=now
+        )
+    for event in events:
+        event.status = PublishEvent.RUNNING
+        event.attempts += 1
+    return events
+
+
+def process_event(event, handlers=None) -> bool:
+    """Run every handler for a claimed event; returns True on success"""
+    entry = Entry.objects.filter(pk=event.entry_id).select_related("owner").first()
+    try:
+        for handler in handlers if handlers is not None else get_handlers():
+            handler(event, entry)
+    except Exception as e:
+        logger.exception(f"Post-publish handler failed for {event}")
+        _retry_or_fail(event, e)
+        return False
+
+    event.status = PublishEvent.DONE
+    event.last_error = ""
+    event.save(update_fields=["status", "last_error", "updated_at"])
+    return True
+
+
+def _retry_or_fail(event, error):
+    max_attempts = getattr(settings, "CMS_PIPELINE_MAX_ATTEMPTS", 5)
+    event.last_error = f"{type(error).__name__}: {error}"
+
+    if event.attempts >= max_attempts:
+        event.status = PublishEvent.FAILED
+        event.save(update_fields=["status", "last_error", "updated_at"])
+        return
+
+    backoff = getattr(settings, "CMS_PIPELINE_RETRY_BACKOFF", 10) * 2 ** (event.attempts - 1)
+    event.status = PublishEvent.PENDING
+    event.available_at = timezone.now() + timedelta(seconds=backoff)
+    try:
+        with transaction.atomic():
+            event.save(update_fields=["status", "available_at", "last_error", "updated_at"])
+    except IntegrityError:
+        # A newer event for this entry is already pending and will redo the work
+        event.status = PublishEvent.DONE
+        event.save(update_fields=["status", "last_error", "updated_at"])
+
+
+def run_pending(batch_size=100) -> int:
+    """Claim and process one batch; returns the number of events handled"""
+    events = claim_events(batch_size)
+    handlers = get_handlers()
+    for event in events:
+        process_event(event, handlers)
+    return len(events)
+
+
+def purge_finished(older_than: timedelta) -> int:
+    """Delete done events older than ``older_than``"""
+    deleted, _ = PublishEvent.objects.filter(
+        status=PublishEvent.DONE, updated_at__lt=timezone.now() - older_than
+    ).delete()
+    return deleted
@@ -0,0 +1,218 @@
+import logging
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .counters import recount
+from .models import Entry, PublishedEntries, PublishEvent
+from .page_cache import bump_page_generation
+from .pipeline import enqueue_publish_events
+from .rendering import render_contents
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["missing", "orphaned", "edited", "stale"]
+
+
+def missing_entries():
+    """Published entries without a PublishedEntries row"""
+    return Entry.objects.filter(published_at__isnull=False, published_version__isnull=True)
+
+
+def orphaned_rows():
+    """PublishedEntries rows whose entry is no longer published"""
+    return PublishedEntries.objects.filter(original_entry__published_at__isnull=True)
+
+
+def edited_rows():
+    """PublishedEntries rows whose contents differ from their entry.
+
+    Contents are compared as stored bytes, so rows written under different
+    compression settings match too; the repair tells the two apart.
+    """
+    return PublishedEntries.objects.filter(
+        original_entry__published_at__isnull=False
+    ).filter(~Q(contents=F("original_entry__contents")))
+
+
+def stale_rows():
+    """PublishedEntries rows whose timestamps or owner differ from their entry"""
+    entry = "original_entry__"
+    return PublishedEntries.objects.filter(
+        original_entry__published_at__isnull=False,
+        contents=F(f"{entry}contents"),
+    ).filter(
+        ~Q(published_at=F(f"{entry}published_at"))
+        | ~Q(created_at=F(f"{entry}created_at"))
+        | ~Q(owner_username=F(f"{entry}owner__username"))
+    )
+
+
+def divergence_counts() -> dict:
+    return {
+        "missing": missing_entries().count(),
+        "orphaned": orphaned_rows().count(),
+        "edited": edited_rows().count(),
+        "stale": stale_rows().count(),
+        "counters": recount(dry_run=True),
+    }
+
+
+def _chunks(queryset, chunk_size):
+    """Primary keys of ``queryset`` in keyset-paginated chunks.
+
+    Repaired rows stop matching the queryset, so the next chunk is looked
+    up again from the last key instead of from an offset.
+    """
+    last_pk = 0
+    while True:
+        pks = list(
+            queryset.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def _published_copy(entry, pk=None) -> PublishedEntries:
+    return PublishedEntries(
+        pk=pk,
+        original_entry=entry,
+        owner_username=entry.owner.username,
+        contents=entry.contents,
+        contents_html=render_contents(entry.contents),
+        created_at=entry.created_at,
+        updated_at=entry.updated_at,
+        published_at=entry.published_at,
+    )
+
+
+# Each repair re-checks its rows under lock, skipping any that a concurrent
+# publish/unpublish fixed since they were found
+
+def _repair_missing(entry_pks) -> int:
+    entries = list(
+        missing_entries().select_for_update(of=("self",))
+        .select_related("owner").filter(pk__in=entry_pks)
+    )
+    PublishedEntries.objects.bulk_create([_published_copy(entry) for entry in entries])
+    get_search_backend().index_many(
+        [(entry.pk, entry.owner.username, entry.contents) for entry in entries]
+    )
+    enqueue_publish_events([entry.pk for entry in entries], PublishEvent.PUBLISH)
+    return len(entries)
+
+
+def _repair_orphaned(published_pks) -> int:
+    rows = dict(
+        orphaned_rows().select_for_update(of=("self",)).filter(pk__in=published_pks)
+        .values_list("pk", "original_entry_id")
+    )
+    PublishedEntries.objects.filter(pk__in=rows).delete()
+    get_search_backend().remove(rows.values())
+    enqueue_publish_events(rows.values(), PublishEvent.UNPUBLISH)
+    return len(rows)
+
+
+def _repair_edited(published_pks) -> int:
+    """Unpublish entries whose contents were changed outside the publish
+    flow: an edit unpublishes, and copying it out would publish unreviewed
+    text. Copies that only differ in compression get the entry's bytes."""
+    rows = list(
+        edited_rows().select_for_update(of=("self",)).filter(pk__in=published_pks)
+        .values_list("pk", "original_entry_id", "contents")
+    )
+    entries = dict(
+        Entry.objects.select_for_update()
+        .filter(pk__in=[entry_id for _, entry_id, _ in rows])
+        .values_list("pk", "contents")
+    )
+    recompressed, edited = [], []
+    for pk, entry_id, contents in rows:
+        if str(contents) == str(entries[entry_id]):
+            recompressed.append(PublishedEntries(pk=pk, contents=entries[entry_id]))
+        else:
+            edited.append(entry_id)
+    PublishedEntries.objects.bulk_update(recompressed, ["contents"])
+    for entry in Entry.objects.select_for_update().filter(pk__in=edited):
+        entry.unpublish()
+    if edited:
+        logger.warning(f"Unpublished entries edited outside the publish flow: {edited}")
+    return len(rows)
+
+
+STALE_FIELDS = ["owner_username", "created_at", "updated_at", "published_at"]
+
+
+def _repair_stale(published_pks) -> int:
+    """Copy drifted timestamps and owner names over. Contents already match,
+    so nothing is re-rendered; only a changed owner is re-indexed."""
+    rows = {
+        row[1]: row
+        for row in stale_rows().select_for_update(of=("self",)).filter(pk__in=published_pks)
+        .values_list("pk", "original_entry_id", *STALE_FIELDS)
+    }
+    entries = (
+        Entry.objects.select_for_update(of=("self",)).filter(pk__in=rows)
+        .values_list("pk", "owner__username", "created_at", "updated_at", "published_at")
+    )
+    updates = {field: [] for field in STALE_FIELDS}
+    renamed = {}
+    for entry_id, *values in entries:
+        pk, _, *current = rows[entry_id]
+        for field, value, old in zip(STALE_FIELDS, values, current):
+            if value != old:
+                updates[field].append(PublishedEntries(pk=pk, **{field: value}))
+        if values[0] != current[0]:
+            renamed[entry_id] = values[0]
+    for field, copies in updates.items():
+        if copies:
+            PublishedEntries.objects.bulk_update(copies, [field])
+    if renamed:
+        get_search_backend().index_many(
+            [
+                (entry_id, renamed[entry_id], str(contents))
+                for entry_id, contents in Entry.objects.select_for_update()
+                .filter(pk__in=renamed)
+                .values_list("pk", "contents")
+            ]
+        )
+    enqueue_publish_events(list(rows), PublishEvent.PUBLISH)
+    return len(rows)
+
+
+REPAIRS = {
+    "missing": (missing_entries, _repair_missing),
+    "orphaned": (orphaned_rows, _repair_orphaned),
+    "edited": (edited_rows, _repair_edited),
+    "stale": (stale_rows, _repair_stale),
+}
+
+
+def reconcile(chunk_size=1000, progress=None) -> dict:
+    """Repair every divergent row, one transaction per chunk.
+
+    Returns the number of rows repaired per kind, plus the number of
+    drifted entry counters rewritten. ``progress(kind, count)`` is called
+    after each chunk.
+    """
+    repaired = dict.fromkeys(KINDS, 0)
+    for kind in KINDS:
+        find, repair = REPAIRS[kind]
+        for pks in _chunks(find(), chunk_size):
+            with transaction.atomic():
+                count = repair(pks)
+                if count:
+                    transaction.on_commit(bump_page_generation)
+            repaired[kind] += count
+            if progress is not None:
+                progress(kind, repaired[kind])
+    repaired["counters"] = recount()
+
+    if any(repaired.values()):
+        logger.info(f"Reconciled published entries: {repaired}")
+    return repaired
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.utils.html import linebreaks
+from django.utils.text import Truncator
+
+
+def render_contents(contents: str) -> str:
+    """Render entry contents the way the ``linebreaks`` template filter does"""
+    return linebreaks(contents, autoescape=True)
+
+
+def make_excerpt(contents: str) -> str:
+    """Return the fixed-length plain-text excerpt shown on listing cards"""
+    length = getattr(settings, "CMS_EXCERPT_LENGTH", 300)
+    return Truncator(contents).chars(length)
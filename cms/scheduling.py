@@ -0,0 +1,85 @@
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .counters import adjust
+from .models import Entry, PublishedEntries, PublishEvent
+from .page_cache import bump_page_generation
+from .pipeline import enqueue_publish_events
+from .rendering import render_contents
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_FIELDS = [
+    "owner_username",
+    "contents",
+    "contents_html",
+    "created_at",
+    "updated_at",
+    "published_at",
+]
+
+
+def publish_due_entries(batch_size=100, now=None) -> int:
+    """Publish one batch of entries whose ``publish_at`` has passed.
+
+    Does what ``Entry.publish`` does for every entry, but with bulk writes
+    and a single page-cache invalidation for the batch. Rows are locked with
+    SKIP LOCKED, so several workers can drain the schedule side by side.
+    Returns the number of entries published.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        entries = list(
+            Entry.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("owner")
+            .filter(publish_at__lte=now)
+            .order_by("publish_at", "pk")[:batch_size]
+        )
+        if not entries:
+            return 0
+
+        # Rescheduled entries that are already published are not counted again
+        newly_published = defaultdict(int)
+        for entry in entries:
+            if entry.published_at is None:
+                newly_published[entry.owner_id] += 1
+            entry.publish_at = None
+            entry.published_at = now
+            entry.updated_at = now
+        Entry.objects.bulk_update(entries, ["publish_at", "published_at", "updated_at"])
+        adjust({owner_id: (0, count) for owner_id, count in newly_published.items()})
+
+        existing = dict(
+            PublishedEntries.objects.filter(original_entry__in=entries).values_list(
+                "original_entry_id", "pk"
+            )
+        )
+        to_create = []
+        to_update = []
+        for entry in entries:
+            published = PublishedEntries(
+                pk=existing.get(entry.pk),
+                original_entry=entry,
+                owner_username=entry.owner.username,
+                contents=entry.contents,
+                contents_html=render_contents(entry.contents),
+                created_at=entry.created_at,
+                updated_at=entry.updated_at,
+                published_at=entry.published_at,
+            )
+            (to_update if published.pk else to_create).append(published)
+        PublishedEntries.objects.bulk_create(to_create)
+        PublishedEntries.objects.bulk_update(to_update, PUBLISHED_FIELDS)
+
+        get_search_backend().index_many(
+            [(entry.pk, entry.owner.username, entry.contents) for entry in entries]
+        )
+        enqueue_publish_events([entry.pk for entry in entries], PublishEvent.PUBLISH)
+        transaction.on_commit(bump_page_generation)
+
+    logger.info(f"Published {len(entries)} scheduled entries")
+    return len(entries)
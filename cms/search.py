@@ -0,0 +1,338 @@
+import functools
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from .models import PublishedEntries
+
+SEARCH_TABLE = "cms_published_search"
+
+# Highlight markers put around matches by the database. They are control
+# characters (stripped from indexed text) so they survive HTML escaping and
+# are swapped for <mark> tags afterwards.
+MARK_START = "\x02"
+MARK_END = "\x03"
+_MARKERS = re.compile(f"[{MARK_START}{MARK_END}]")
+
+
+def query_terms(query: str) -> list:
+    """Words of a search query; operators and punctuation are ignored"""
+    max_terms = getattr(settings, "CMS_SEARCH_MAX_TERMS", 10)
+    return re.findall(r"\w+", query.lower())[:max_terms]
+
+
+def highlight(snippet: str) -> str:
+    """Escape a snippet, then turn the match markers into <mark> tags"""
+    html = escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+    return mark_safe(html)
+
+
+def _clean(text: str) -> str:
+    return _MARKERS.sub("", text)
+
+
+class SearchBackend:
+    """Full-text index of published entries, keyed by entry id.
+
+    The base class indexes nothing and finds nothing; it is used on
+    databases without a full-text backend so publishing keeps working.
+    """
+
+    def create_index(self, schema_editor):
+        pass
+
+    def drop_index(self, schema_editor):
+        pass
+
+    def index_many(self, rows, using=None):
+        """Add or replace ``(entry_id, owner_username, contents)`` rows"""
+
+    def remove(self, entry_ids):
+        pass
+
+    def clear(self):
+        pass
+
+    def optimize(self):
+        pass
+
+    def search(self, terms, offset, limit) -> list:
+        """``(entry_id, snippet)`` pairs for the best matches, best first"""
+        return []
+
+    def count(self, terms) -> int:
+        return 0
+
+    def match_ids(self, terms, limit) -> list:
+        """Ids of up to ``limit`` matching entries, without snippets"""
+        return []
+
+    def index(self, entry_id, owner_username, contents):
+        self.index_many([(entry_id, owner_username, contents)])
+
+    def _connection(self, write=False, using=None):
+        if using is None:
+            using = (
+                router.db_for_write(PublishedEntries)
+                if write
+                else router.db_for_read(PublishedEntries)
+            )
+        return connections[using]
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 table ranked with bm25, usernames weighted above text"""
+
+    def create_index(self, schema_editor):
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "owner_username, contents, tokenize = 'porter unicode61 remove_diacritics 2')"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_many(self, rows, using=None):
+        rows = [(entry_id, username, _clean(contents)) for entry_id, username, contents in rows]
+        if not rows:
+            return
+        with self._connection(write=True, using=using).cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                [(entry_id,) for entry_id, _, _ in rows],
+            )
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, owner_username, contents) "
+                "VALUES (%s, %s, %s)",
+                rows,
+            )
+
+    def remove(self, entry_ids):
+        with self._connection(write=True).cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                [(entry_id,) for entry_id in entry_ids],
+            )
+
+    def clear(self):
+        with self._connection(write=True).cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    def optimize(self):
+        with self._connection(write=True).cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+    def _match(self, terms) -> str:
+        # Quote every term so FTS5 syntax in the query is taken literally;
+        # the last one is a prefix so partly typed words still match
+        phrases = [f'"{term}"' for term in terms]
+        phrases[-1] += "*"
+        return " ".join(phrases)
+
+    def search(self, terms, offset, limit):
+        if not terms:
+            return []
+        words = getattr(settings, "CMS_SEARCH_SNIPPET_WORDS", 24)
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({SEARCH_TABLE}, 1, %s, %s, '…', %s) "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                f"ORDER BY bm25({SEARCH_TABLE}, 5.0, 1.0) LIMIT %s OFFSET %s",
+                [MARK_START, MARK_END, words, self._match(terms), limit, offset],
+            )
+            return cursor.fetchall()
+
+    def count(self, terms):
+        if not terms:
+            return 0
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+                [self._match(terms)],
+            )
+            return cursor.fetchone()[0]
+
+    def match_ids(self, terms, limit):
+        if not terms:
+            return []
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                f"ORDER BY bm25({SEARCH_TABLE}, 5.0, 1.0) LIMIT %s",
+                [self._match(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """PostgreSQL table with a generated, GIN-indexed tsvector"""
+
+    def _config(self):
+        return getattr(settings, "CMS_SEARCH_CONFIG", "english")
+
+    def create_index(self, schema_editor):
+        config = self._config()
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "entry_id bigint PRIMARY KEY, "
+            "owner_username text NOT NULL, "
+            "contents text NOT NULL, "
+            "document tsvector GENERATED ALWAYS AS ("
+            f"setweight(to_tsvector('{config}', owner_username), 'A') || "
+            f"setweight(to_tsvector('{config}', contents), 'B')"
+            ") STORED)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document "
+            f"ON {SEARCH_TABLE} USING gin (document)"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_many(self, rows, using=None):
+        rows = [(entry_id, username, _clean(contents)) for entry_id, username, contents in rows]
+        if not rows:
+            return
+        with self._connection(write=True, using=using).cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (entry_id, owner_username, contents) "
+                "VALUES (%s, %s, %s) ON CONFLICT (entry_id) DO UPDATE SET "
+                "owner_username = EXCLUDED.owner_username, contents = EXCLUDED.contents",
+                rows,
+            )
+
+    def remove(self, entry_ids):
+        with self._connection(write=True).cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE entry_id = ANY(%s)", [list(entry_ids)]
+            )
+
+    def clear(self):
+        with self._connection(write=True).cursor() as cursor:
+            cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+
+    def _tsquery(self, terms) -> str:
+        # Every term must match; the last one is a prefix
+        return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+    def search(self, terms, offset, limit):
+        if not terms:
+            return []
+        words = getattr(settings, "CMS_SEARCH_SNIPPET_WORDS", 24)
+        options = (
+            f"StartSel={MARK_START}, StopSel={MARK_END}, MaxWords={words}, "
+            f"MinWords={max(words // 3, 1)}, MaxFragments=2, FragmentDelimiter=\" … \""
+        )
+        config = self._config()
+        with self._connection().cursor() as cursor:
+            # Headlines are built for the page of hits only, not every match
+            cursor.execute(
+                f"SELECT hits.entry_id, ts_headline(%s, hits.contents, hits.query, %s) FROM ("
+                f"SELECT entry_id, contents, query, ts_rank_cd(document, query) AS rank "
+                f"FROM {SEARCH_TABLE}, to_tsquery(%s, %s) query "
+                "WHERE document @@ query ORDER BY rank DESC LIMIT %s OFFSET %s"
+                ") hits ORDER BY hits.rank DESC",
+                [config, options, config, self._tsquery(terms), limit, offset],
+            )
+            return cursor.fetchall()
+
+    def count(self, terms):
+        if not terms:
+            return 0
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT count(*) FROM {SEARCH_TABLE} WHERE document @@ to_tsquery(%s, %s)",
+                [self._config(), self._tsquery(terms)],
+            )
+            return cursor.fetchone()[0]
+
+    def match_ids(self, terms, limit):
+        if not terms:
+            return []
+        with self._connection().cursor() as cursor:
+            cursor.execute(
+                f"SELECT entry_id FROM {SEARCH_TABLE} "
+                "WHERE document @@ to_tsquery(%s, %s) LIMIT %s",
+                [self._config(), self._tsquery(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+VENDOR_BACKENDS = {
+    "sqlite": "cms.search.SQLiteFTSBackend",
+    "postgresql": "cms.search.PostgresSearchBackend",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_backend(path: str) -> SearchBackend:
+    return import_string(path)()
+
+
+def get_search_backend(vendor=None) -> SearchBackend:
+    """The CMS_SEARCH_BACKEND class, or the one for the database vendor"""
+    path = getattr(settings, "CMS_SEARCH_BACKEND", None)
+    if path is None:
+        # Read routing: asking for the write alias would pin the request to
+        # the primary (replicas run the same database engine anyway)
+        vendor = vendor or connections[router.db_for_read(PublishedEntries)].vendor
+        path = VENDOR_BACKENDS.get(vendor, "cms.search.SearchBackend")
+    return _load_backend(path)
+
+
+class SearchResults:
+    """Lazily evaluated search hits that Django's Paginator can slice.
+
+    Each item is a PublishedEntries row (contents deferred) with a
+    ``snippet`` attribute holding the highlighted match.
+    """
+
+    def __init__(self, query: str, backend=None):
+        self.query = query
+        self.terms = query_terms(query)
+        self.backend = backend or get_search_backend()
+
+    @functools.cached_property
+    def _count(self):
+        return self.backend.count(self.terms)
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = self._count if key.stop is None else key.stop
+        if stop <= start:
+            return []
+
+        hits = self.backend.search(self.terms, start, stop - start)
+        entries = (
+            PublishedEntries.objects.defer("contents", "contents_html")
+            .in_bulk([entry_id for entry_id, _ in hits], field_name="original_entry_id")
+        )
+        results = []
+        for entry_id, snippet in hits:
+            # The index may briefly hold an entry that was just unpublished
+            entry = entries.get(entry_id)
+            if entry is not None:
+                entry.snippet = highlight(snippet)
+                results.append(entry)
+        return results
+
+
+def index_published_entry(entry):
+    get_search_backend().index(entry.pk, entry.owner.username, entry.contents)
+
+
+def remove_from_index(entry_ids):
+    get_search_backend().remove(entry_ids)
@@ -0,0 +1,133 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .backends import invalidate_cached_users
+from .bundle import record_policy_data_change
+from .counters import adjust, entry_deltas
+from .models import Entry, EntryCounter
+from .page_cache import bump_page_generation
+from .opa_client import opa_client
+from .search import remove_from_index
+
+logger = logging.getLogger(__name__)
+
+_warmup_executor = None
+
+
+def get_warmup_executor() -> ThreadPoolExecutor:
+    """Shared background executor for permission warm-up"""
+    global _warmup_executor
+    if _warmup_executor is None:
+        _warmup_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "OPA_WARMUP_WORKERS", 2),
+            thread_name_prefix="opa-warmup",
+        )
+    return _warmup_executor
+
+
+def warm_user_permissions(user_id):
+    """Load a user and warm their OPA decisions (runs off the request path)"""
+    try:
+        user = User.objects.prefetch_related("groups").filter(pk=user_id).first()
+        if user is not None:
+            opa_client.warm_user_decisions(user)
+    except Exception as e:
+        logger.error(f"Permission warm-up failed for user {user_id}: {e}")
+    finally:
+        # Worker threads hold their own connections; do not leak them
+        connections.close_all()
+
+
+@receiver(user_logged_in)
+def warm_permissions_on_login(sender, request, user, **kwargs):
+    if not getattr(settings, "OPA_WARMUP_ON_LOGIN", True):
+        return
+    get_warmup_executor().submit(warm_user_permissions, user.pk)
+
+
+# ============= OPA BUNDLE DATA / CACHED USERS =============
+# Record every change to what data.users holds so the bundle server can
+# bump its revision and send OPA a delta, and drop the affected users'
+# cached snapshots (cms.backends.CachedModelBackend).
+
+def users_changed(user_ids):
+    user_ids = list(user_ids)
+    record_policy_data_change(user_ids)
+    invalidate_cached_users(user_ids)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # group.user_set.clear() does not say whom it removes; note the
+        # members now and act once they are gone
+        instance._cms_cleared_user_ids = list(instance.user_set.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        users_changed([instance.pk])
+    elif action == "post_clear":
+        users_changed(instance.__dict__.pop("_cms_cleared_user_ids", []))
+    else:
+        users_changed(pk_set)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # Any saved field may be in the cached snapshot; the password also
+    # decides whether existing sessions stay valid
+    invalidate_cached_users([instance.pk])
+    # Logins only touch last_login, which is not part of the policy data
+    if update_fields is not None and set(update_fields) <= {"last_login", "password"}:
+        return
+    record_policy_data_change([instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    users_changed([instance.pk])
+    # Their entries were deleted (and uncounted) before them
+    EntryCounter.objects.filter(owner_id=instance.pk).delete()
+
+
+@receiver(user_logged_out)
+def invalidate_user_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_cached_users([user.pk])
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    # A renamed group changes the group list of every member
+    if not created:
+        users_changed(instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    users_changed(instance.user_set.values_list("pk", flat=True))
+
+
+# ============= SEARCH INDEX / PAGE CACHE / COUNTERS =============
+
+@receiver(post_save, sender=Entry)
+def entry_created(sender, instance, created, **kwargs):
+    if created:
+        adjust(entry_deltas([instance]))
+
+
+@receiver(post_delete, sender=Entry)
+def entry_deleted(sender, instance, **kwargs):
+    # Deleting an entry cascades to its published copy, bypassing unpublish()
+    remove_from_index([instance.pk])
+    adjust(entry_deltas([instance], sign=-1))
+    if instance.published_at is not None:
+        transaction.on_commit(bump_page_generation)
@@ -1,3 +1,1531 @@
-from django.test import TestCase
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import socketserver
+import statistics
+import string
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from .bundle import acknowledged_change_id, parse_revision
+from .checks import check_bundle_token
+from .counters import actual_counts, counts, recount
+from .db_router import ReplicaRouter, is_pinned_to_primary, pin_after_writes
+from . import fields
+from .fields import RAW, ZLIB, CompressedValue
+from .middleware import PrimaryPinningMiddleware
+from .models import Entry, EntryCounter, PolicyDataChange, PublishedEntries, PublishEvent
+from .opa_client import _Admission, opa_client
+from .page_cache import page_cache, page_generation
+from .pipeline import claim_events, enqueue_publish_event, process_event
+from .reconcile import divergence_counts, reconcile
+from .rendering import render_contents
+from .scheduling import publish_due_entries
+from .search import SearchResults
+from .urls import public_urlpatterns, urlpatterns
+from .warmup import run_warmup
+
+POLICY_FILE = settings.BASE_DIR / "cms_authz.rego"
+CMS_GROUPS = ["viewer", "editor", "publisher"]
+
+# Expected decisions, as documented in the README permission table
+PUBLIC_GRANTS = {("view", "published_entries")}
+GROUP_GRANTS = {
+    "viewer": {("list", "entries"), ("view", "entry")},
+    "editor": {
+        ("list", "entries"),
+        ("view", "entry"),
+        ("create", "entry"),
+        ("edit", "entry"),
+        ("delete", "entry"),
+    },
+    "publisher": {
+        ("list", "entries"),
+        ("view", "entry"),
+        ("publish", "entry"),
+        ("unpublish", "entry"),
+    },
+}
+STAFF_GRANTS = {
+    (action, resource)
+    for action in ["list", "view", "create", "edit", "delete", "publish", "unpublish", "moderate"]
+    for resource in ["entry", "entries", "published_entries"]
+}
+PERMISSION_TOKENS = {
+    "anonymous": ["view_published"],
+    "viewer": ["view_all", "list"],
+    "editor": ["view_all", "list", "create", "edit_all", "delete_all"],
+    "publisher": ["view_all", "list", "publish_all"],
+    "staff": ["view_all", "list", "create", "edit_all", "delete_all", "publish_all", "moderate", "admin"],
+}
+
+# p95 decision latency (cache misses) that the matrix must stay under
+DECISION_BUDGET_MS = float(os.environ.get("OPA_DECISION_BUDGET_MS", 50))
+
+
+def expected_allow(groups, is_staff, authenticated, action, resource):
+    granted = set(PUBLIC_GRANTS)
+    if authenticated:
+        for group in groups:
+            granted |= GROUP_GRANTS[group]
+        if is_staff:
+            granted |= STAFF_GRANTS
+    return (action, resource) in granted
+
+
+def expected_permission_tokens(groups, is_staff, authenticated):
+    if not authenticated:
+        return PERMISSION_TOKENS["anonymous"]
+    if is_staff:
+        return PERMISSION_TOKENS["staff"]
+    for group in ["publisher", "editor", "viewer"]:
+        if group in groups:
+            return PERMISSION_TOKENS[group]
+    return []
+
+
+def view_permission_pairs():
+    """(url name, view class) for every view guarded by OPAPermissionMixin"""
+    pairs = []
+    for pattern in urlpatterns + public_urlpatterns:
+        if not isinstance(pattern, URLPattern):
+            continue
+        view_class = getattr(pattern.callback, "view_class", None)
+        if getattr(view_class, "required_permission", None):
+            name = pattern.name if pattern in public_urlpatterns else f"cms:{pattern.name}"
+            pairs.append((name, view_class))
+    return pairs
+
+
+class UnsupportedPolicy(Exception):
+    pass
+
+
+class RegoStandIn:
+    """Evaluate the rules of cms_authz.rego without an OPA binary.
+
+    The policy file is parsed, not transcribed, so edits to it are tested.
+    Only the statements the policy currently uses are understood; anything
+    else raises UnsupportedPolicy so the stand-in is extended alongside the
+    policy (or the tests are run with a real ``opa`` on the PATH).
+    """
+
+    RULE = re.compile(
+        r"^(allow|user_permissions := (\[.*?\])) if \{\n(.*?)\n\}", re.MULTILINE | re.DOTALL
+    )
+    # (statement, check, whether the statement depends on the user)
+    CONDITIONS = [
+        (re.compile(r"^(not )?subject\.(is_authenticated|is_staff)$"),
+         lambda m, user, data: bool(user.get(m[2])) != bool(m[1]), True),
+        (re.compile(r'^(not )?has_group\(subject, "(\w+)"\)$'),
+         lambda m, user, data: (m[2] in user.get("groups", [])) != bool(m[1]), True),
+        (re.compile(r'^input\.(action|resource) == "(\w+)"$'),
+         lambda m, user, data: data.get(m[1]) == m[2], False),
+        (re.compile(r"^input\.(action|resource) in (\[.*\])$"),
+         lambda m, user, data: data.get(m[1]) in json.loads(m[2]), False),
+    ]
+
+    def __init__(self, source):
+        self.allow_rules = []
+        self.permission_rules = []
+        for match in self.RULE.finditer(source):
+            conditions = [
+                self._parse(line.strip())
+                for line in match[3].splitlines()
+                if line.strip() and not line.strip().startswith("#")
+            ]
+            if match[1] == "allow":
+                self.allow_rules.append(conditions)
+            else:
+                self.permission_rules.append((json.loads(match[2]), conditions))
+
+    def _parse(self, statement):
+        for pattern, check, on_user in self.CONDITIONS:
+            match = pattern.match(statement)
+            if match:
+                return (lambda user, data, m=match, check=check: check(m, user, data)), on_user
+        raise UnsupportedPolicy(f"Stand-in cannot evaluate: {statement}")
+
+    def evaluate(self, data):
+        user = data.get("user", {})
+
+        def holds(conditions):
+            return all(condition(user, data) for condition, _ in conditions)
+
+        result = {
+            "allow": any(holds(rule) for rule in self.allow_rules),
+            "permissions": [],
+        }
+        if data.get("action") == "get_permissions" and data.get("resource") == "user_permissions":
+            values = {tuple(value) for value, conditions in self.permission_rules if holds(conditions)}
+            if len(values) > 1:
+                raise UnsupportedPolicy("eval_conflict_error: complete rules must not produce multiple outputs")
+            if values:
+                result["permissions"] = list(values.pop())
+        if "batch" in data:
+            result["decisions"] = {
+                f"{item['action']}:{item['resource']}": self.evaluate({**data, **item, "batch": []})
+                for item in data["batch"]
+            }
+        return result
+
+    def partially_evaluate(self, data):
+        """/v1/compile of allow with the user unknown: one residual query
+        (its user conditions) per allow rule that can still hold"""
+        queries = []
+        for conditions in self.allow_rules:
+            if all(condition({}, data) for condition, on_user in conditions if not on_user):
+                queries.append([{"index": i} for i, (_, on_user) in enumerate(conditions) if on_user])
+        return {"queries": queries} if queries else {}
+
+    def transport(self):
+        def handle(request):
+            try:
+                body = json.loads(request.content)
+                if request.url.path == "/v1/compile":
+                    return httpx.Response(200, json={"result": self.partially_evaluate(body["input"])})
+                result = self.evaluate(body["input"])
+            except UnsupportedPolicy as e:
+                return httpx.Response(500, json={"code": "internal_error", "message": str(e)})
+            return httpx.Response(200, json={"result": result})
+
+        return httpx.MockTransport(handle)
+
+
+class OPAServer:
+    """A real ``opa run --server`` loaded with cms_authz.rego"""
+
+    def __init__(self, binary):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [binary, "run", "--server", "--addr", f"127.0.0.1:{self.port}", str(POLICY_FILE)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(f"{self.url}/health").status_code == 200:
+                    return
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("OPA server did not become healthy")
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class PolicyMatrixTests(TestCase):
+    """Check cms_authz.rego against every view's action/resource pair.
+
+    Decisions go through the real OPAClient to a real OPA when ``opa`` is
+    on the PATH (or OPA_BINARY is set) and to RegoStandIn otherwise.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.latencies = []
+        cls.opa_server = None
+        binary = os.environ.get("OPA_BINARY") or shutil.which("opa")
+        if binary:
+            cls.opa_server = OPAServer(binary)
+            patches = [mock.patch.object(opa_client, "opa_url", cls.opa_server.url)]
+        else:
+            stand_in = RegoStandIn(POLICY_FILE.read_text())
+            patches = [mock.patch.object(opa_client, "transport", stand_in.transport())]
+        for patch in patches:
+            patch.start()
+            cls.addClassCleanup(patch.stop)
+        if cls.opa_server:
+            cls.addClassCleanup(cls.opa_server.stop)
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in CMS_GROUPS:
+            Group.objects.create(name=name)
+        cls.owner = User.objects.create_user("owner")
+        cls.entry = Entry.objects.create(owner=cls.owner, contents="Matrix entry")
+
+    def setUp(self):
+        cache.clear()
+
+    def users(self):
+        """Anonymous plus every combination of CMS groups, with and without staff"""
+        yield ("anonymous", (), False, AnonymousUser())
+        combinations = itertools.chain.from_iterable(
+            itertools.combinations(CMS_GROUPS, size) for size in range(len(CMS_GROUPS) + 1)
+        )
+        for groups, is_staff in itertools.product(list(combinations), [False, True]):
+            username = "_".join(("staff",) * is_staff + groups) or "no_group"
+            user = User.objects.create_user(username, is_staff=is_staff)
+            user.groups.set(Group.objects.filter(name__in=groups))
+            yield (username, groups, is_staff, user)
+
+    def timed_check(self, user, action, resource):
+        cache.clear()
+        start = time.perf_counter()
+        allowed = opa_client.check_permission(user, action, resource)
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        return allowed
+
+    def test_views_cover_documented_actions(self):
+        pairs = {(view.required_permission, view.resource_type) for _, view in view_permission_pairs()}
+        documented = PUBLIC_GRANTS.union(*GROUP_GRANTS.values())
+        self.assertLessEqual(pairs, documented | STAFF_GRANTS)
+        self.assertIn(("publish", "entry"), pairs)
+
+    def test_decision_matrix(self):
+        pairs = {(view.required_permission, view.resource_type) for _, view in view_permission_pairs()}
+        for username, groups, is_staff, user in self.users():
+            authenticated = user.is_authenticated
+            for action, resource in sorted(pairs):
+                with self.subTest(user=username, action=action, resource=resource):
+                    self.assertEqual(
+                        self.timed_check(user, action, resource),
+                        expected_allow(groups, is_staff, authenticated, action, resource),
+                    )
+            with self.subTest(user=username, action="get_permissions"):
+                self.assertEqual(
+                    opa_client.get_user_permissions(user),
+                    expected_permission_tokens(groups, is_staff, authenticated),
+                )
+
+        self.assertLatencyWithinBudget()
+
+    def test_views_enforce_decisions(self):
+        for username, groups, is_staff, user in self.users():
+            if user.is_authenticated:
+                self.client.force_login(user)
+            for name, view in view_permission_pairs():
+                kwargs = {"pk": self.entry.pk} if "<int:pk>" in self._route(name) else {}
+                with self.subTest(user=username, view=name):
+                    cache.clear()
+                    response = self.client.get(reverse(name, kwargs=kwargs))
+                    if not user.is_authenticated and name.startswith("cms:"):
+                        self.assertEqual(response.status_code, 302)
+                        continue
+                    allowed = expected_allow(
+                        groups, is_staff, user.is_authenticated,
+                        view.required_permission, view.resource_type,
+                    )
+                    # Publish views only accept POST: 405 means the policy let it through
+                    self.assertEqual(response.status_code != 403, allowed)
+            self.client.logout()
+
+    def test_warm_up_matches_single_decisions(self):
+        user = User.objects.create_user("warm")
+        user.groups.set(Group.objects.filter(name="editor"))
+
+        self.assertEqual(opa_client.warm_user_decisions(user), 25)
+        with mock.patch.object(opa_client, "_post_query", side_effect=AssertionError("cache miss")):
+            self.assertTrue(opa_client.check_permission(user, "edit", "entry"))
+            self.assertFalse(opa_client.check_permission(user, "publish", "entry"))
+            self.assertEqual(opa_client.get_user_permissions(user), PERMISSION_TOKENS["editor"])
+
+    def _route(self, name):
+        for pattern in urlpatterns + public_urlpatterns:
+            if name.split(":")[-1] == pattern.name:
+                return str(pattern.pattern)
+        return ""
+
+    def assertLatencyWithinBudget(self):
+        latencies = sorted(self.latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        report_path = os.environ.get("OPA_LATENCY_REPORT")
+        if report_path:
+            with open(report_path, "w") as report:
+                json.dump({
+                    "backend": "opa" if self.opa_server else "stand-in",
+                    "decisions": len(latencies),
+                    "mean_ms": statistics.mean(latencies),
+                    "p95_ms": p95,
+                    "max_ms": latencies[-1],
+                }, report, indent=2)
+        self.assertLess(
+            p95, DECISION_BUDGET_MS,
+            f"p95 decision latency {p95:.2f}ms exceeds {DECISION_BUDGET_MS}ms budget",
+        )
+
+
+class OPAClientSingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("flight")
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_query(self, input_data, encoded=None):
+        self.calls += 1
+        self.release.wait(5)
+        return {"allow": True, "permissions": []}
+
+    def test_concurrent_misses_share_one_query(self):
+        results = []
+        with mock.patch.object(opa_client, "_post_query", side_effect=self.slow_query):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        opa_client.check_permission(self.user, "list", "entries")
+                    )
+                )
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.1)
+            self.release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [True] * 8)
+
+    def test_early_refresh_serves_cached_decision(self):
+        self.release.set()
+        with mock.patch.object(opa_client, "_post_query", side_effect=self.slow_query):
+            opa_client.check_permission(self.user, "list", "entries")
+            # Make the decision look almost expired and expensive to recompute
+            key = opa_client._cache_key(opa_client._permission_input(
+                opa_client._serialize_user(self.user), "list", "entries"
+            ))
+            cache.set(key, {**cache.get(key), "expires": time.time() + 0.001, "delta": 10})
+            self.assertTrue(opa_client.check_permission(self.user, "list", "entries"))
+
+        self.assertEqual(self.calls, 2)
+
+    def test_failed_refresh_keeps_the_known_decision(self):
+        key = opa_client._cache_key(opa_client._permission_input(
+            opa_client._serialize_user(self.user), "list", "entries"
+        ))
+        allow = {"allow": True, "permissions": []}
+        down = mock.patch.object(
+            opa_client, "_post_query", side_effect=httpx.ConnectError("refused")
+        )
+        with down, self.assertLogs("cms.opa_client", "ERROR"):
+            # About to expire: early refresh runs and fails
+            cache.set(key, {"result": allow, "expires": time.time() + 0.001, "delta": 10})
+            self.assertTrue(opa_client.check_permission(self.user, "list", "entries"))
+            # Expired but within the stale window
+            cache.set(key, {"result": allow, "expires": time.time() - 1, "delta": 0})
+            self.assertTrue(opa_client.check_permission(self.user, "list", "entries"))
+            # Nothing known: the restrictive fallback
+            cache.delete(key)
+            self.assertFalse(opa_client.check_permission(self.user, "list", "entries"))
+
+
+class OPAAdmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("admission")
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        # One slot, no queue: a second concurrent call is shed at once
+        patcher = mock.patch.object(opa_client, "_admission", _Admission(1, 0, 0.05))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def slow_query(self, input_data, encoded=None):
+        self.release.wait(5)
+        return {"allow": True, "permissions": []}
+
+    def decision_key(self, action, resource):
+        return opa_client._cache_key(opa_client._permission_input(
+            opa_client._serialize_user(self.user), action, resource
+        ))
+
+    def test_saturated_opa_sheds_to_stale_decision_or_fallback(self):
+        # An expired decision is still cached for the stale window
+        cache.set(self.decision_key("view", "entry"), {
+            "result": {"allow": True, "permissions": []},
+            "expires": time.time() - 1,
+            "delta": 0,
+        })
+        before = opa_client.admission_metrics()
+
+        with mock.patch.object(opa_client, "_post_query", side_effect=self.slow_query):
+            holder = threading.Thread(
+                target=opa_client.check_permission, args=(self.user, "list", "entries")
+            )
+            holder.start()
+            while opa_client._admission.active == 0:
+                time.sleep(0.01)
+
+            self.assertTrue(opa_client.check_permission(self.user, "view", "entry"))
+            self.assertFalse(opa_client.check_permission(self.user, "create", "entry"))
+            self.release.set()
+            holder.join()
+
+        after = opa_client.admission_metrics()
+        self.assertEqual(after["active"], 0)
+        for name, delta in [
+            ("admitted", 1), ("rejected_queue_full", 2), ("shed_stale", 1), ("shed_fallback", 1),
+        ]:
+            self.assertEqual(after[name] - before[name], delta, name)
+
+    def test_queued_call_waits_for_a_slot(self):
+        admission = _Admission(1, 1, 0.2)
+        self.assertIsNone(admission.acquire())
+        threading.Timer(0.05, admission.release).start()
+        self.assertIsNone(admission.acquire())
+        # Nobody releases this time, so the queue deadline passes
+        self.assertEqual(admission.acquire(), "queue_timeout")
+        self.assertEqual((admission.active, admission.waiting, admission.max_waiting), (1, 0, 1))
+
+
+class UnixSocketOPA(socketserver.ThreadingUnixStreamServer):
+    """Answers every OPA query with ``allow``, recording request bodies"""
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.bodies = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server.bodies.append(self.rfile.read(int(self.headers["Content-Length"])))
+                body = b'{"result":{"allow":true,"permissions":[]}}'
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(path, Handler)
+
+
+class OPATransportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("sidecar")
+        path = os.path.join(tempfile.mkdtemp(), "opa.sock")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        self.server = UnixSocketOPA(path)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        for name, value in (("unix_socket", path), ("transport", None)):
+            patcher = mock.patch.object(opa_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_decisions_over_unix_socket_reuse_serialized_input(self):
+        self.assertTrue(opa_client.check_permission(self.user, "view", "entry"))
+
+        [body] = self.server.bodies
+        self.assertTrue(body.startswith(b'{"input":') and body.endswith(b"}"))
+        encoded = body[len(b'{"input":'):-1]
+        self.assertEqual(json.loads(encoded)["action"], "view")
+        key = f"opa_{hashlib.sha256(encoded).hexdigest()}"
+        self.assertEqual(cache.get(key)["result"]["allow"], True)
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user("root", is_staff=True, is_superuser=True)
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        for owner in (self.alice, self.bob):
+            Entry.objects.create(owner=owner, contents=f"Entry by {owner.username}").publish()
+        self.client.force_login(self.admin)
+
+    def test_owner_filter_matches_exact_username(self):
+        url = reverse("admin:cms_entry_changelist")
+        response = self.client.get(url, {"owner": "alice"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [entry.owner for entry in response.context["cl"].result_list], [self.alice]
+        )
+        # No per-user filter links in the sidebar
+        self.assertNotContains(response, "?owner__id__exact=")
+
+    def test_published_changelist_filters_and_searches_by_username(self):
+        url = reverse("admin:cms_publishedentries_changelist")
+        for params in ({"owner": "bob"}, {"q": "bob"}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [entry.owner_username for entry in response.context["cl"].result_list],
+                ["bob"],
+            )
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class PublishedSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache().clear()
+        self.alice = User.objects.create_user("alice")
+        self.garden = Entry.objects.create(
+            owner=self.alice, contents="Tomatoes need <b>sun</b> and regular watering."
+        )
+        self.garden.publish()
+        self.kitchen = Entry.objects.create(
+            owner=self.alice, contents="A tomato soup recipe for cold evenings."
+        )
+        self.kitchen.publish()
+        self.allow = mock.patch.object(opa_client, "check_permission", return_value=True)
+        self.allow.start()
+        self.addCleanup(self.allow.stop)
+
+    def search(self, query):
+        response = self.client.get(reverse("published_search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_search_ranks_and_highlights_matches(self):
+        response = self.search("watering")
+        self.assertEqual(
+            [entry.original_entry_id for entry in response.context["results"]],
+            [self.garden.pk],
+        )
+        # Entry text is escaped before the match is marked
+        self.assertContains(response, "<mark>watering</mark>")
+        self.assertContains(response, "&lt;b&gt;sun&lt;/b&gt;")
+        self.assertNotContains(response, "<b>sun</b>")
+        # Stemming and prefix matching find both entries
+        self.assertEqual(self.search("tomato").context["paginator"].count, 2)
+
+    def test_unpublish_and_delete_remove_entries_from_index(self):
+        self.garden.unpublish()
+        self.kitchen.delete()
+        self.assertEqual(self.search("tomato").context["paginator"].count, 0)
+
+    def test_search_does_not_pin_to_primary(self):
+        response = self.search("tomato")
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.search('"tomato* -(')
+        self.assertEqual(response.context["paginator"].count, 2)
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class CachedIdentityTests(TestCase):
+    IDENTITY_TABLES = ('FROM "auth_user"', 'FROM "django_session"', '"auth_group"')
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("carol")
+        self.user.groups.add(Group.objects.create(name="Editor"))
+        self.opa_inputs = []
+        patcher = mock.patch.object(opa_client, "_post_query", side_effect=self.post_query)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_query(self, input_data, encoded=None):
+        self.opa_inputs.append(input_data)
+        return {"allow": True, "permissions": []}
+
+    def identity_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("cms:entry_list"))
+        self.assertEqual(response.status_code, 200)
+        return [
+            query["sql"]
+            for query in queries.captured_queries
+            if any(table in query["sql"] for table in self.IDENTITY_TABLES)
+        ]
+
+    def test_warm_requests_load_identity_from_cache(self):
+        self.client.force_login(self.user)
+        self.identity_queries()
+        self.assertEqual(self.identity_queries(), [])
+        self.assertEqual(self.opa_inputs[-1]["user"]["groups"], ["editor"])
+
+    def test_group_and_password_changes_invalidate_cached_user(self):
+        self.client.force_login(self.user)
+        self.identity_queries()
+
+        self.user.groups.add(Group.objects.create(name="Publisher"))
+        self.assertTrue(self.identity_queries())
+        self.assertEqual(
+            sorted(self.opa_inputs[-1]["user"]["groups"]), ["editor", "publisher"]
+        )
+
+        self.user.set_password("changed")
+        self.user.save()
+        response = self.client.get(reverse("cms:entry_list"))
+        self.assertRedirects(
+            response, f"{reverse('cms:login')}?next={reverse('cms:entry_list')}"
+        )
+
+    def test_snapshot_cached_before_commit_is_dropped_on_commit(self):
+        self.client.force_login(self.user)
+        key = f"cms_user_{self.user.pk}"
+        editor = self.user.groups.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            editor.user_set.clear()
+            # A request served before the commit caches the user again
+            self.identity_queries()
+            self.assertIsNotNone(cache.get(key))
+        self.assertIsNone(cache.get(key))
+        self.identity_queries()
+        self.assertEqual(self.opa_inputs[-1]["user"]["groups"], [])
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache().clear()
+        self.alice = User.objects.create_user("alice")
+        Entry.objects.create(owner=self.alice, contents="First story").publish()
+        self.compiled = {"queries": [[]]}
+        self.queries = []
+        for name, side_effect in (
+            ("_post_compile", lambda *args: self.compiled),
+            ("_post_query", self.post_query),
+        ):
+            patcher = mock.patch.object(opa_client, name, side_effect=side_effect)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def post_query(self, input_data, encoded=None):
+        self.queries.append(input_data)
+        return {"allow": True, "permissions": []}
+
+    def test_anonymous_pages_are_cached_until_content_changes(self):
+        url = reverse("published_list")
+        self.assertContains(self.client.get(url), "First story")
+        with CaptureQueriesContext(connection) as db_queries:
+            self.assertContains(self.client.get(url), "First story")
+        self.assertEqual(len(db_queries), 0)
+        # The policy was proven user-independent once; OPA was never queried
+        self.assertEqual(self._post_compile.call_count, 1)
+        self.assertEqual(self.queries, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Entry.objects.create(owner=self.alice, contents="Second story").publish()
+        self.assertContains(self.client.get(url), "Second story")
+
+    def test_pages_are_kept_apart_and_keyed_by_used_parameters(self):
+        url = reverse("published_list")
+        self.client.get(url, {"utm_source": "mail"})
+        cache.clear()
+        # The page and the generation
+        self.assertEqual(len(page_cache()._cache), 2)
+        with CaptureQueriesContext(connection) as db_queries:
+            self.assertContains(self.client.get(url, {"fbclid": "x"}), "First story")
+        self.assertEqual(len(db_queries), 0)
+        self.assertNotContains(self.client.get(url, {"page": 2}), "First story", status_code=404)
+        self.assertEqual(len(page_cache()._cache), 2)
+
+    def test_authenticated_users_bypass_the_cache(self):
+        url = reverse("published_list")
+        self.client.get(url)
+        self.client.force_login(self.alice)
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertIsNotNone(response.context)
+
+    def test_user_dependent_policy_is_checked_per_request(self):
+        self.compiled = {"queries": [[{"index": 0}]]}
+        self.client.force_login(self.alice)
+        self.client.get(reverse("published_list"))
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.queries[0]["user"]["username"], "alice")
+
+
+@override_settings(
+    OPA_WARMUP_ON_LOGIN=False, CMS_SERVER_TIMING=True, CMS_SLOW_REQUEST_MS=0,
+    CMS_SLOW_REQUEST_SAMPLE_RATE=1.0,
+)
+class ServerTimingTests(TestCase):
+    def test_header_breaks_down_request_time(self):
+        cache.clear()
+        user = User.objects.create_user("dave")
+        user.groups.add(Group.objects.create(name="viewer"))
+        Entry.objects.create(owner=user, contents="Timed")
+        self.client.force_login(user)
+        transport = RegoStandIn(POLICY_FILE.read_text()).transport()
+
+        with mock.patch.object(opa_client, "transport", transport), \
+                self.assertLogs("cms.middleware", "WARNING") as logs:
+            response = self.client.get(reverse("cms:entry_list"))
+
+        metrics = {
+            metric.split(";")[0]: metric for metric in response["Server-Timing"].split(", ")
+        }
+        self.assertEqual(set(metrics), {"opa", "cache", "db", "template", "total"})
+        self.assertIn('desc="Templates (1)"', metrics["template"])
+        # Sampled slow-request log carries the span tree
+        self.assertIn("template cms/entry_list.html", logs.output[0])
+        self.assertIn("opa list:entries", logs.output[0])
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False, CMS_EXCERPT_LENGTH=20)
+class PreRenderedListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache().clear()
+        self.owner = User.objects.create_user("mona")
+        self.entry = Entry.objects.create(
+            owner=self.owner, contents="<script>alert(1)</script>\n\nA second paragraph that runs on"
+        )
+        patcher = mock.patch.object(opa_client, "check_permission", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertContentsNotLoaded(self, queries, table):
+        self.assertFalse(
+            [q for q in queries.captured_queries if f'"{table}"."contents"' in q["sql"]]
+        )
+
+    def test_publish_stores_escaped_html_and_entries_keep_an_excerpt(self):
+        self.assertEqual(self.entry.excerpt, "<script>alert(1)</s…")
+        self.entry.publish()
+        self.assertEqual(
+            str(PublishedEntries.objects.get().contents_html),
+            "<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>\n\n"
+            "<p>A second paragraph that runs on</p>",
+        )
+
+    def test_published_list_renders_stored_html_without_contents(self):
+        self.entry.publish()
+        with mock.patch.object(opa_client, "_post_compile", return_value={"queries": [[]]}), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("published_list"))
+        self.assertContains(response, "<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>", html=True)
+        self.assertContentsNotLoaded(queries, "cms_publishedentries")
+
+    def test_entry_list_renders_excerpts_without_contents(self):
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("cms:entry_list"))
+        self.assertContains(response, "&lt;script&gt;alert(1)&lt;/s…")
+        self.assertNotContains(response, "second paragraph")
+        self.assertContentsNotLoaded(queries, "cms_entry")
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False, CMS_COMPRESSION_THRESHOLD=64)
+class CompressedTextFieldTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user("nina")
+
+    def stored(self, entry) -> bytes:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT contents FROM cms_entry WHERE id = %s", [entry.pk])
+            return bytes(cursor.fetchone()[0])
+
+    def test_values_are_stored_raw_or_compressed_by_size(self):
+        short = Entry.objects.create(owner=self.owner, contents="Short note")
+        self.assertEqual(self.stored(short), RAW + b"Short note")
+
+        text = "A long, repetitive story. " * 40
+        long = Entry.objects.create(owner=self.owner, contents=text)
+        data = self.stored(long)
+        self.assertEqual(data[:1], ZLIB)
+        self.assertLess(len(data), len(text))
+        self.assertEqual(Entry.objects.get(pk=long.pk).contents, text)
+
+    def test_incompressible_values_are_stored_raw(self):
+        # No repeats for zlib to use, so its header makes it longer
+        text = string.ascii_letters + string.digits + "!#$%&()*+"
+        self.assertGreaterEqual(len(zlib.compress(text.encode(), 6)), len(text.encode()))
+        entry = Entry.objects.create(owner=self.owner, contents=text)
+        self.assertEqual(self.stored(entry), RAW + text.encode())
+
+    def test_contents_are_decompressed_once_on_first_read(self):
+        text = "Decompressed only when shown. " * 10
+        Entry.objects.create(owner=self.owner, contents=text)
+        with mock.patch.object(
+            fields, "decompress_text", wraps=fields.decompress_text
+        ) as decompress:
+            entry = Entry.objects.get()
+            self.assertIsInstance(entry.__dict__["contents"], CompressedValue)
+            self.assertEqual(decompress.call_count, 0)
+            self.assertEqual(entry.contents, text)
+            self.assertEqual(entry.contents, text)
+            self.assertEqual(decompress.call_count, 1)
+
+    def test_untouched_contents_are_saved_without_recompressing(self):
+        entry = Entry.objects.create(owner=self.owner, contents="Kept as stored. " * 10)
+        before = self.stored(entry)
+        with override_settings(CMS_COMPRESSION_THRESHOLD=10 ** 6), mock.patch.object(
+            fields, "compress_text", wraps=fields.compress_text
+        ) as compress:
+            entry = Entry.objects.get()
+            entry.publish_at = timezone.now()
+            entry.save()
+        self.assertEqual(compress.call_count, 0)
+        self.assertEqual(self.stored(entry), before)
+
+    def test_saving_with_contents_deferred_keeps_them_and_the_excerpt(self):
+        entry = Entry.objects.create(owner=self.owner, contents="Deferred body. " * 10)
+        excerpt = entry.excerpt
+        deferred = Entry.objects.defer("contents").get()
+        deferred.publish_at = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            deferred.save()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("contents", deferred.__dict__)
+        entry.refresh_from_db()
+        self.assertEqual(entry.contents, "Deferred body. " * 10)
+        self.assertEqual(entry.excerpt, excerpt)
+
+
+@override_settings(CMS_COMPRESSION_THRESHOLD=64)
+class CompressContentsMigrationTests(TransactionTestCase):
+    before = [("cms", "0003_rendered_contents_and_excerpts")]
+    after = [("cms", "0004_compress_contents")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_contents_survive_compressing_and_reverting(self):
+        text = "Stored before compression. " * 20
+        apps = self.migrate(self.before)
+        owner = apps.get_model("auth", "User").objects.create(username="olive")
+        entry = apps.get_model("cms", "Entry").objects.create(owner=owner, contents=text)
+        apps.get_model("cms", "PublishedEntries").objects.create(
+            original_entry=entry, owner_username="olive", contents=text,
+            contents_html="<p>Short</p>", created_at=entry.created_at,
+            updated_at=entry.updated_at, published_at=timezone.now(),
+        )
+
+        apps = self.migrate(self.after)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT contents FROM cms_entry")
+            self.assertEqual(bytes(cursor.fetchone()[0])[:1], ZLIB)
+        published = apps.get_model("cms", "PublishedEntries").objects.get()
+        self.assertEqual(str(published.contents), text)
+        self.assertEqual(str(published.contents_html), "<p>Short</p>")
+
+        apps = self.migrate(self.before)
+        self.assertEqual(apps.get_model("cms", "Entry").objects.get().contents, text)
+        published = apps.get_model("cms", "PublishedEntries").objects.get()
+        self.assertEqual(published.contents, text)
+        self.assertEqual(published.contents_html, "<p>Short</p>")
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class ImportExportTests(TestCase):
+    def test_round_trip_keeps_timestamps_and_published_versions(self):
+        owner = User.objects.create_user("erin")
+        draft = Entry.objects.create(owner=owner, contents="Draft notes")
+        story = Entry.objects.create(owner=owner, contents="A <b>published</b> story " * 80)
+        story.publish()
+        Entry.objects.filter(pk=draft.pk).update(created_at="2020-01-02T03:04:05Z")
+
+        export = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "entries.jsonl")
+        call_command("export_entries", export, stderr=io.StringIO())
+        Entry.objects.all().delete()
+        call_command("import_entries", export, chunk_size=1, stdout=io.StringIO())
+
+        imported = {entry.contents: entry for entry in Entry.objects.all()}
+        self.assertEqual(set(imported), {"Draft notes", story.contents})
+        self.assertEqual(imported["Draft notes"].created_at.year, 2020)
+        self.assertIsNone(imported["Draft notes"].published_at)
+
+        copy = imported[story.contents]
+        self.assertEqual(copy.published_at, story.published_at)
+        self.assertEqual(copy.excerpt, story.excerpt)
+        self.assertEqual(copy.published_version.contents_html, render_contents(story.contents))
+        self.assertEqual(SearchResults("published").count(), 1)
+
+    def test_unknown_owner_stops_import(self):
+        export = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "entries.jsonl")
+        with open(export, "w") as f:
+            f.write(json.dumps({
+                "owner": "nobody", "contents": "x", "created_at": None,
+                "updated_at": None, "published_at": None, "published": None,
+            }) + "\n")
+        with self.assertRaisesMessage(CommandError, "unknown owner 'nobody'"):
+            call_command("import_entries", export, stdout=io.StringIO())
+
+    def test_malformed_records_name_the_line(self):
+        User.objects.create_user("bob")
+        cases = [
+            ({"owner": "bob"}, "Line 2: invalid entry record (missing 'contents')"),
+            ({"owner": "bob", "contents": "x", "created_at": "yesterday"},
+             "Line 2: invalid entry record (invalid datetime 'yesterday')"),
+            ({"owner": "bob", "contents": "x", "published_at": "2020-13-01T00:00:00Z"},
+             "Line 2: invalid entry record ("),
+            ({"owner": "bob", "contents": "x", "published": {"created_at": None}},
+             "Line 2: invalid entry record (missing 'contents')"),
+            ({"owner": "bob", "contents": 7}, "Line 2: invalid entry record (contents must"),
+        ]
+        export = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "entries.jsonl")
+        for record, message in cases:
+            with self.subTest(record=record):
+                with open(export, "w") as f:
+                    f.write(json.dumps({"owner": "bob", "contents": "fine"}) + "\n")
+                    f.write(json.dumps(record) + "\n")
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command("import_entries", export, stdout=io.StringIO())
+                self.assertFalse(Entry.objects.exists())
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class WarmPermissionsCommandTests(TestCase):
+    def test_process_local_cache_is_refused(self):
+        with self.assertRaisesMessage(CommandError, "configure a shared cache"):
+            call_command("warm_permissions", stdout=io.StringIO())
+
+    def test_failed_and_skipped_users_are_reported_apart(self):
+        for username in ("ok", "down", "busy"):
+            User.objects.create_user(username)
+        location = self.enterContext(tempfile.TemporaryDirectory())
+        shared = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": location,
+        }}
+        outcomes = {"ok": 25, "down": 0, "busy": None}
+        stdout = io.StringIO()
+        with override_settings(CACHES=shared), mock.patch.object(
+            opa_client, "warm_user_decisions", side_effect=lambda user: outcomes[user.username]
+        ):
+            call_command("warm_permissions", stdout=stdout)
+
+        output = stdout.getvalue()
+        self.assertIn("Warmed 25 decisions for 1 user", output)
+        self.assertIn("Could not warm 1 user - is OPA reachable?", output)
+        self.assertIn("Skipped 1 user - OPA was saturated", output)
+
+    def test_users_are_submitted_one_chunk_at_a_time(self):
+        for i in range(5):
+            User.objects.create_user(f"user{i}")
+        location = self.enterContext(tempfile.TemporaryDirectory())
+        shared = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": location,
+        }}
+        pending, most_pending = 0, 0
+        lock = threading.Lock()
+
+        def submit(executor, fn, *iterables):
+            nonlocal pending, most_pending
+            users = list(iterables[0])
+            with lock:
+                pending += len(users)
+                most_pending = max(most_pending, pending)
+            for count in map(fn, users):
+                with lock:
+                    pending -= 1
+                yield count
+
+        with override_settings(CACHES=shared), mock.patch.object(
+            opa_client, "warm_user_decisions", return_value=3
+        ), mock.patch("concurrent.futures.ThreadPoolExecutor.map", submit):
+            stdout = io.StringIO()
+            call_command("warm_permissions", chunk_size=2, stdout=stdout)
+        self.assertIn("Warmed 15 decisions for 5 users", stdout.getvalue())
+        self.assertEqual(most_pending, 2)
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False, CMS_WARMUP_ON_STARTUP=True)
+class StartupWarmupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache().clear()
+        owner = User.objects.create_user("lena")
+        Entry.objects.create(owner=owner, contents="Warm story").publish()
+        for patcher in (
+            mock.patch("cms.warmup._ready", threading.Event()),
+            mock.patch.object(opa_client, "prime_connections", return_value=4),
+            mock.patch.object(opa_client, "_post_compile", return_value={"queries": [[]]}),
+            mock.patch.object(opa_client, "check_permission", return_value=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_readiness_turns_200_after_warmup(self):
+        response = self.client.get(reverse("readiness"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"ready": False})
+
+        results = run_warmup()
+        self.assertEqual([name for name, ok, _, _ in results if not ok], [])
+        self.assertEqual(results[-1][0], "public_page")
+
+        response = self.client.get(reverse("readiness"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"ready": True})
+
+    @override_settings(CMS_WARMUP_ON_STARTUP=False)
+    def test_ready_without_startup_warmup(self):
+        self.assertEqual(self.client.get(reverse("readiness")).status_code, 200)
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class ScheduledPublishingTests(TestCase):
+    def test_due_entries_are_published_in_one_batch(self):
+        cache.clear()
+        owner = User.objects.create_user("frank")
+        now = timezone.now()
+        republished = Entry.objects.create(owner=owner, contents="Old text")
+        republished.publish()
+        republished.contents = "Embargoed update"
+        republished.save()
+        due = [republished] + [
+            Entry.objects.create(owner=owner, contents=f"Embargoed story {i}") for i in range(3)
+        ]
+        for entry in due:
+            entry.schedule_publish(now - timedelta(minutes=1))
+        later = Entry.objects.create(owner=owner, contents="Tomorrow's story")
+        later.schedule_publish(now + timedelta(days=1))
+        generation = page_generation()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(publish_due_entries(batch_size=10, now=now), 4)
+
+        self.assertEqual(page_generation(), generation + 1)
+        self.assertFalse(Entry.objects.filter(publish_at__lte=now).exists())
+        self.assertEqual(
+            set(PublishedEntries.objects.values_list("original_entry_id", flat=True)),
+            {entry.pk for entry in due},
+        )
+        self.assertEqual(
+            str(PublishedEntries.objects.get(original_entry=republished).contents),
+            "Embargoed update",
+        )
+        self.assertEqual(
+            set(PublishEvent.objects.values_list("entry_id", flat=True)),
+            {entry.pk for entry in due},
+        )
+        self.assertEqual(SearchResults("embargoed").count(), 4)
+        self.assertIsNone(Entry.objects.get(pk=later.pk).published_at)
+        self.assertEqual(publish_due_entries(batch_size=10, now=now), 0)
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class ReconcileTests(TestCase):
+    def test_divergent_rows_are_found_and_repaired(self):
+        owner = User.objects.create_user("grace")
+        entries = [
+            Entry.objects.create(owner=owner, contents=f"Story {i} " * 300) for i in range(6)
+        ]
+        for entry in entries:
+            entry.publish()
+        consistent, missing, orphaned, edited, stale, recompressed = entries
+        PublishedEntries.objects.filter(original_entry=missing).delete()
+        Entry.objects.filter(pk=orphaned.pk).update(published_at=None)
+        edited.contents = "Edited in the admin"
+        edited.save()
+        Entry.objects.filter(pk=stale.pk).update(created_at="2020-01-02T03:04:05Z")
+        # Same text, stored uncompressed (as under an older threshold)
+        PublishedEntries.objects.filter(original_entry=recompressed).update(
+            contents=RAW + recompressed.contents.encode()
+        )
+
+        # The bypassing update also left the owner's and site-wide counters off
+        divergent = {"missing": 1, "orphaned": 1, "edited": 2, "stale": 1, "counters": 2}
+        self.assertEqual(divergence_counts(), divergent)
+        with self.assertLogs("cms.reconcile", "WARNING") as logs:
+            self.assertEqual(reconcile(chunk_size=1), divergent)
+        self.assertIn(f"[{edited.pk}]", logs.output[0])
+        self.assertEqual(
+            divergence_counts(),
+            {"missing": 0, "orphaned": 0, "edited": 0, "stale": 0, "counters": 0},
+        )
+
+        self.assertEqual(
+            set(PublishedEntries.objects.values_list("original_entry_id", flat=True)),
+            {consistent.pk, missing.pk, stale.pk, recompressed.pk},
+        )
+        # The unreviewed edit was unpublished, not copied out
+        self.assertIsNone(Entry.objects.get(pk=edited.pk).published_at)
+        self.assertEqual(
+            PublishedEntries.objects.get(original_entry=stale).created_at.year, 2020
+        )
+
+    def test_stale_rows_only_get_their_drifted_columns(self):
+        owner = User.objects.create_user("ivan")
+        moved, renamed = (
+            Entry.objects.create(owner=owner, contents=f"Story {i} " * 300) for i in range(2)
+        )
+        moved.publish()
+        Entry.objects.filter(pk=moved.pk).update(created_at="2020-01-02T03:04:05Z")
+        with mock.patch("cms.reconcile.render_contents") as render, mock.patch(
+            "cms.search.SQLiteFTSBackend.index_many"
+        ) as index_many:
+            self.assertEqual(reconcile()["stale"], 1)
+        render.assert_not_called()
+        index_many.assert_not_called()
+        self.assertEqual(PublishedEntries.objects.get(original_entry=moved).created_at.year, 2020)
+
+        renamed.publish()
+        owner.username = "ivan2"
+        owner.save()
+        self.assertEqual(reconcile()["stale"], 2)
+        self.assertEqual(SearchResults("ivan2").count(), 2)
+
+    def test_editing_a_published_entry_removes_its_public_copy(self):
+        owner = User.objects.create_user("heidi")
+        entry = Entry.objects.create(owner=owner, contents="Before")
+        entry.publish()
+        self.client.force_login(owner)
+        with mock.patch.object(opa_client, "check_permission", return_value=True):
+            self.client.post(reverse("cms:entry_edit", args=[entry.pk]), {"contents": "After"})
+
+        self.assertIsNone(Entry.objects.get(pk=entry.pk).published_at)
+        self.assertFalse(PublishedEntries.objects.exists())
+        self.assertEqual(
+            divergence_counts(),
+            {"missing": 0, "orphaned": 0, "edited": 0, "stale": 0, "counters": 0},
+        )
+
+
+@override_settings(OPA_WARMUP_ON_LOGIN=False)
+class EntryCounterTests(TestCase):
+    def assertCountersMatch(self):
+        stored = dict(
+            (owner_id, (entries, published))
+            for owner_id, entries, published
+            in EntryCounter.objects.values_list("owner_id", "entries", "published")
+        )
+        self.assertEqual(stored, actual_counts())
+
+    def test_publish_path_keeps_counters_exact(self):
+        ivan = User.objects.create_user("ivan")
+        judy = User.objects.create_user("judy")
+        drafts = [Entry.objects.create(owner=ivan, contents=f"Draft {i}") for i in range(3)]
+        story = Entry.objects.create(owner=judy, contents="Story")
+        story.publish()
+        story.publish()  # Republishing does not count twice
+        drafts[0].publish()
+        drafts[1].schedule_publish(timezone.now() - timedelta(minutes=1))
+        publish_due_entries()
+        self.assertEqual(counts(), (4, 3))
+        self.assertEqual(counts(ivan.pk), (3, 2))
+        self.assertCountersMatch()
+
+        drafts[0].unpublish()
+        # Published by the scheduler, so reload it like a delete view would
+        Entry.objects.get(pk=drafts[1].pk).delete()
+        self.assertEqual(counts(ivan.pk), (2, 0))
+        judy.delete()
+        self.assertEqual(counts(), (2, 0))
+        self.assertFalse(EntryCounter.objects.filter(owner_id=judy.pk).exists())
+        self.assertCountersMatch()
+
+    def test_racing_publishes_count_once(self):
+        owner = User.objects.create_user("olga")
+        Entry.objects.create(owner=owner, contents="Clicked twice")
+        # Two requests load the entry before either publishes it
+        first, second = Entry.objects.all(), Entry.objects.all()
+        first[0].publish()
+        second[0].publish()
+        self.assertEqual(counts(owner.pk), (1, 1))
+
+        first, second = Entry.objects.all(), Entry.objects.all()
+        first[0].unpublish()
+        second[0].unpublish()
+        self.assertEqual(counts(owner.pk), (1, 0))
+        self.assertCountersMatch()
+
+    def test_recount_repairs_drift_per_owner(self):
+        pat = User.objects.create_user("pat")
+        quinn = User.objects.create_user("quinn")
+        Entry.objects.create(owner=pat, contents="One").publish()
+        Entry.objects.create(owner=quinn, contents="Two")
+        Entry.objects.filter(owner=pat).update(published_at=None)
+        EntryCounter.objects.create(owner_id=9999, entries=3)
+
+        self.assertEqual(recount(dry_run=True), 3)  # pat, 9999 and the totals
+        self.assertEqual(recount(), 3)
+        self.assertEqual(recount(dry_run=True), 0)
+        self.assertCountersMatch()
+
+    def test_listing_counts_come_from_counters(self):
+        owner = User.objects.create_user("kim")
+        for i in range(25):
+            Entry.objects.create(owner=owner, contents=f"Entry {i}").publish()
+        self.client.force_login(owner)
+
+        with mock.patch.object(opa_client, "check_permission", return_value=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("cms:entry_list"))
+        self.assertContains(response, "Showing 1–20 of 25 entries")
+        self.assertFalse([q for q in queries.captured_queries if "COUNT(" in q["sql"].upper()])
+
+        cache.clear()
+        with mock.patch.object(opa_client, "check_permission", return_value=True):
+            response = self.client.get(reverse("published_list"), {"page": 2})
+        self.assertContains(response, "Showing 21–25 of 25 published entries")
+
+
+class PublishPipelineTests(TestCase):
+    def setUp(self):
+        self.entry = Entry.objects.create(owner=User.objects.create_user("liam"), contents="Text")
+
+    def test_events_for_one_entry_coalesce_while_pending(self):
+        self.entry.publish()
+        self.entry.unpublish()
+        self.entry.publish()
+        [event] = PublishEvent.objects.all()
+        self.assertEqual((event.kind, event.status, event.coalesced), ("publish", "pending", 2))
+
+    @override_settings(CMS_PIPELINE_MAX_ATTEMPTS=2, CMS_PIPELINE_RETRY_BACKOFF=10)
+    def test_failed_events_are_retried_with_backoff_then_failed(self):
+        def broken(event, entry):
+            raise RuntimeError("webhook down")
+
+        enqueue_publish_event(self.entry.pk, PublishEvent.PUBLISH)
+        [event] = claim_events(10)
+        with self.assertLogs("cms.pipeline", "ERROR"):
+            self.assertFalse(process_event(event, [broken]))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ("pending", 1))
+        self.assertEqual(event.last_error, "RuntimeError: webhook down")
+        self.assertGreater(event.available_at, timezone.now() + timedelta(seconds=9))
+        self.assertEqual(claim_events(10), [])  # Not due yet
+
+        PublishEvent.objects.update(available_at=timezone.now())
+        [event] = claim_events(10)
+        with self.assertLogs("cms.pipeline", "ERROR"):
+            self.assertFalse(process_event(event, [broken]))
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ("failed", 2))
+
+        # Read from the table, not a per-process cache
+        cache.clear()
+        stats = io.StringIO()
+        call_command("run_publish_worker", stats=True, stdout=stats)
+        for line in ("enqueued: 1", "retried: 1", "queue_failed: 1", "queue_pending: 0"):
+            self.assertIn(line, stats.getvalue())
+
+    def test_stale_running_events_are_requeued_once_per_entry(self):
+        # Both outlived their lease, e.g. every worker was killed
+        for _ in range(2):
+            PublishEvent.objects.create(
+                entry_id=self.entry.pk, kind=PublishEvent.PUBLISH, status=PublishEvent.RUNNING
+            )
+        PublishEvent.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        older, newer = PublishEvent.objects.order_by("pk")
+
+        [event] = claim_events(10)
+        self.assertEqual(event.pk, newer.pk)
+        older.refresh_from_db()
+        self.assertEqual(older.status, "done")
+        self.assertTrue(process_event(event, []))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.enterContext(pin_after_writes())
+        self.router = ReplicaRouter()
+
+    def test_reads_use_replicas_until_the_context_writes(self):
+        self.assertEqual(self.router.db_for_read(Entry), "replica")
+        self.assertEqual(self.router.db_for_read(User), "default")
+        # Asking where writes go, reading and savepoints do not pin
+        self.assertEqual(self.router.db_for_write(Entry), "default")
+        with transaction.atomic():
+            list(User.objects.all())
+        self.assertEqual(self.router.db_for_read(Entry), "replica")
+
+        User.objects.create_user("nina")
+        self.assertTrue(is_pinned_to_primary())
+        self.assertEqual(self.router.db_for_read(Entry), "default")
+
+
+class PrimaryPinningMiddlewareTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.pinned_in_view = []
+
+    def respond(self, request, write=False):
+        def view(request):
+            if write:
+                User.objects.create_user(f"writer{User.objects.count()}")
+            self.pinned_in_view.append(is_pinned_to_primary())
+            return HttpResponse()
+
+        return PrimaryPinningMiddleware(view)(request)
+
+    def test_pin_cookie_is_set_only_after_writes(self):
+        cookie = settings.REPLICA_PIN_COOKIE
+        self.assertNotIn(cookie, self.respond(self.factory.get("/")).cookies)
+        self.assertIn(cookie, self.respond(self.factory.get("/"), write=True).cookies)
+        self.assertIn(cookie, self.respond(self.factory.post("/")).cookies)
+        self.assertEqual(self.pinned_in_view, [False, True, True])
+
+    def test_requests_with_the_cookie_read_from_the_primary(self):
+        request = self.factory.get("/")
+        request.COOKIES[settings.REPLICA_PIN_COOKIE] = "1"
+        response = self.respond(request)
+        self.assertEqual(self.pinned_in_view, [True])
+        # Reads alone do not extend the pin
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+
+@override_settings(
+    OPA_WARMUP_ON_LOGIN=False, CMS_SERVER_TIMING=True, CMS_SLOW_REQUEST_MS=0,
+    CMS_SLOW_REQUEST_SAMPLE_RATE=0.0, DATABASE_REPLICAS=["replica"],
+)
+class PrimaryPinningStackTests(TransactionTestCase):
+    def test_pinning_survives_connections_opened_inside_requests(self):
+        owner = User.objects.create_user("uma")
+        self.client.force_login(owner)
+
+        def check_and_write(*args, **kwargs):
+            PolicyDataChange.objects.create(user_id=owner.pk)
+            return True
+
+        with mock.patch.object(opa_client, "check_permission", side_effect=check_and_write):
+            for _ in range(2):
+                # Persistent connections are opened by the first query of a
+                # request, inside the timing middleware's wrapper
+                connection.close()
+                response = self.client.get(reverse("cms:entry_list"))
+                self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+                self.assertEqual(connection.execute_wrappers, [])
+                self.client.cookies.pop(settings.REPLICA_PIN_COOKIE)
+
+
+@override_settings(
+    OPA_WARMUP_ON_LOGIN=False, OPA_BUNDLE_TOKEN=None,
+    OPA_BUNDLE_TOKENS={"opa-a": "token-a", "opa-b": "token-b"},
+)
+class BundleServerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.editor = Group.objects.create(name="Editor")
+        self.user = User.objects.create_user("rita")
+        self.user.groups.add(self.editor)
+
+    def fetch(self, revision=None, client="opa-a", **headers):
+        if revision:
+            headers["HTTP_IF_NONE_MATCH"] = f'"{revision}"'
+        if client:
+            headers.setdefault("HTTP_AUTHORIZATION", f"Bearer token-{client[-1]}")
+        return self.client.get(reverse("opa_bundle"), **headers)
+
+    def files(self, response):
+        with tarfile.open(fileobj=io.BytesIO(response.content), mode="r:gz") as tar:
+            return {
+                member.name: json.load(tar.extractfile(member))
+                for member in tar
+                if member.name.endswith((".json", ".manifest"))
+            }
+
+    def test_bundle_requires_a_client_token(self):
+        self.assertEqual(self.fetch(client=None).status_code, 401)
+        self.assertEqual(self.fetch(HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        self.assertEqual(self.fetch(client="opa-a").status_code, 200)
+        self.assertEqual(self.fetch(client="opa-b").status_code, 200)
+        with override_settings(OPA_BUNDLE_TOKENS={}, OPA_BUNDLE_TOKEN="s3cret"):
+            self.assertEqual(self.fetch(HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+    @override_settings(OPA_BUNDLE_TOKENS={})
+    def test_bundle_is_not_served_without_a_token(self):
+        self.assertEqual(self.fetch(client=None).status_code, 404)
+        with override_settings(OPA_USE_BUNDLE_DATA=True):
+            self.assertEqual([error.id for error in check_bundle_token(None)], ["cms.E001"])
+
+    def test_snapshot_then_304_then_delta(self):
+        response = self.fetch()
+        revision = response["ETag"].strip('"')
+        files = self.files(response)
+        self.assertEqual(files[".manifest"]["revision"], revision)
+        self.assertEqual(files["users/data.json"][str(self.user.pk)]["groups"], ["editor"])
+
+        self.assertEqual(self.fetch(revision).status_code, 304)
+
+        self.user.groups.remove(self.editor)
+        response = self.fetch(revision)
+        self.assertEqual(response.status_code, 200)
+        patch = self.files(response)["patch.json"]["data"]
+        self.assertIn(
+            {"op": "upsert", "path": f"/users/{self.user.pk}",
+             "value": {"username": "rita", "is_staff": False, "groups": []}},
+            patch,
+        )
+
+    def test_change_committed_late_below_the_revision_is_sent(self):
+        other = User.objects.create_user("sam")
+        latest = PolicyDataChange.objects.latest("id").id
+        # Id latest + 2 commits first; latest + 1 commits after OPA fetched
+        PolicyDataChange.objects.create(id=latest + 2, user_id=self.user.pk)
+        revision = self.fetch()["ETag"].strip('"')
+        self.assertEqual(acknowledged_change_id(parse_revision(revision)), latest + 2)
+        PolicyDataChange.objects.create(id=latest + 1, user_id=other.pk)
+
+        # The revision OPA holds no longer vouches for ids in its window
+        self.assertLess(acknowledged_change_id(parse_revision(revision)), latest + 1)
+        response = self.fetch(revision)
+        self.assertEqual(response.status_code, 200)
+        paths = {op["path"] for op in self.files(response)["patch.json"]["data"]}
+        self.assertIn(f"/users/{other.pk}", paths)
+
+    def test_bundle_data_decisions_wait_for_every_opa_to_hold_the_change(self):
+        calls = []
+
+        def post_query(input_data, encoded=None):
+            calls.append(input_data["user"]["data_version"])
+            return {"allow": True, "permissions": []}
+
+        def check():
+            opa_client.check_permission(self.user, "create", "entry")
+            opa_client.check_permission(self.user, "create", "entry")
+            return len(calls)
+
+        with mock.patch.object(opa_client, "use_bundle_data", True), \
+                mock.patch.object(opa_client, "_post_query", side_effect=post_query):
+            # Downloading a bundle is not holding it; anonymous polls count for nothing
+            revision = self.fetch(client="opa-a")["ETag"].strip('"')
+            self.fetch(revision, client=None)
+            self.assertEqual(check(), 2)
+
+            self.fetch(revision, client="opa-a")
+            self.assertEqual(check(), 4)
+            self.fetch(revision, client="opa-b")
+            self.assertEqual(check(), 5)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.groups.remove(self.editor)
+            for client in ("opa-a", "opa-b"):
+                self.fetch(revision, client=client)
+            self.assertEqual(check(), 7)
+
+            revision = self.fetch(client="opa-a")["ETag"].strip('"')
+            for client in ("opa-a", "opa-b"):
+                self.fetch(revision, client=client)
+            self.assertEqual(check(), 8)
+            self.assertGreater(calls[-1], calls[0])
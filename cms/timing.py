@@ -0,0 +1,147 @@
+import contextvars
+import time
+
+_current_trace = contextvars.ContextVar("cms_request_trace", default=None)
+
+# Categories reported in the Server-Timing header, in header order
+CATEGORIES = {
+    "opa": "OPA",
+    "cache": "Cache",
+    "db": "SQL",
+    "template": "Templates",
+}
+
+
+class Span:
+    __slots__ = ("category", "name", "start", "end", "children")
+
+    def __init__(self, category, name):
+        self.category = category
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+class Trace:
+    """Span tree of one request"""
+
+    def __init__(self, name=""):
+        self.root = Span("request", name)
+        self._stack = [self.root]
+
+    def begin(self, category, name="") -> Span:
+        span = Span(category, name)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        return span
+
+    def end(self, span):
+        span.end = time.perf_counter()
+        if span in self._stack:
+            # Also closes children that were never ended
+            del self._stack[self._stack.index(span):]
+
+    def finish(self):
+        self.end(self.root)
+
+    def totals(self) -> dict:
+        """(milliseconds, count) per category, not counting a span nested
+        in another span of the same category twice"""
+        totals = {}
+
+        def walk(span, open_categories):
+            for child in span.children:
+                if child.category not in open_categories:
+                    ms, count = totals.get(child.category, (0.0, 0))
+                    totals[child.category] = (ms + child.duration_ms, count + 1)
+                walk(child, open_categories | {child.category})
+
+        walk(self.root, frozenset())
+        return totals
+
+    def server_timing(self) -> str:
+        totals = self.totals()
+        metrics = []
+        for category, label in CATEGORIES.items():
+            if category in totals:
+                ms, count = totals[category]
+                metrics.append(f'{category};dur={ms:.1f};desc="{label} ({count})"')
+        metrics.append(f'total;dur={self.root.duration_ms:.1f}')
+        return ", ".join(metrics)
+
+    def format_tree(self) -> str:
+        lines = []
+
+        def walk(span, depth):
+            name = f" {span.name}" if span.name else ""
+            lines.append(f"{'  ' * depth}{span.category}{name} {span.duration_ms:.1f}ms")
+            for child in span.children:
+                walk(child, depth + 1)
+
+        walk(self.root, 0)
+        return "\n".join(lines)
+
+
+class _SpanContext:
+    __slots__ = ("trace", "category", "name", "span")
+
+    def __init__(self, trace, category, name):
+        self.trace = trace
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.span = self.trace.begin(self.category, self.name)
+        return self.span
+
+    def __exit__(self, *exc_info):
+        self.trace.end(self.span)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(category, name=""):
+    """Time a block as part of the current request's trace.
+
+    Outside a traced request (management commands, worker threads) this is
+    a shared no-op context manager.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _SpanContext(trace, category, name)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def start_trace(name=""):
+    """Begin tracing; returns the token to pass to ``stop_trace``"""
+    return _current_trace.set(Trace(name))
+
+
+def stop_trace(token):
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is not None:
+        trace.finish()
+    return trace
@@ -1,6 +1,7 @@
 from django.urls import path
 
 from . import views
+from .page_cache import anonymous_page_cache
 
 app_name = "cms"
 urlpatterns = [
@@ -26,11 +27,28 @@ urlpatterns = [
     ),
 ]
 
-# Public URLs (outside the cms app namespace)
+# Public URLs (outside the cms app namespace); full pages are cached for
+# anonymous visitors
 public_urlpatterns = [
     path(
         "published/",
-        views.PublishedEntriesListView.as_view(),
+        anonymous_page_cache(views.PublishedEntriesListView.as_view()),
         name="published_list",
     ),
-]
\ No newline at end of file
+    path(
+        "published/search/",
+        anonymous_page_cache(views.PublishedSearchView.as_view()),
+        name="published_search",
+    ),
+]
+
+# OPA bundle service (outside the cms app namespace)
+opa_urlpatterns = [
+    path("bundles/cms.tar.gz", views.OPABundleView.as_view(), name="opa_bundle"),
+]
+
+# Health checks for load balancers (outside the cms app namespace)
+health_urlpatterns = [
+    path("ready/", views.ReadinessView.as_view(), name="readiness"),
+    path("opa/", views.OPAAdmissionView.as_view(), name="opa_admission"),
+]
@@ -2,13 +2,27 @@ from django.views.generic import CreateView, ListView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
 from django.urls import reverse_lazy
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
 from django.views import View
+from .bundle import (
+    authenticate_bundle_client,
+    build_delta_bundle,
+    build_snapshot_bundle,
+    bundle_clients,
+    current_revision,
+    parse_revision,
+    record_acknowledged_revision,
+)
 from .models import Entry, PublishedEntries
 from .mixins import OPAPermissionMixin, OPAEntryPermissionMixin
 from .opa_client import opa_client
+from .paginators import EstimatedCountPaginator
+from .search import SearchResults
+from .warmup import is_ready
 
 
 class CMSLoginView(LoginView):
@@ -33,10 +47,17 @@ class EntryListView(LoginRequiredMixin, OPAPermissionMixin, ListView):
     template_name = "cms/entry_list.html"
     context_object_name = "entries"
     ordering = ["-created_at"]  # Show newest entries first
+    paginate_by = 20
+    # Counts come from the maintained entry counters, not COUNT(*)
+    paginator_class = EstimatedCountPaginator
     login_url = "cms:login"
     required_permission = "list"
     resource_type = "entries"
 
+    def get_queryset(self):
+        # Cards only show the stored excerpt, so skip loading full contents
+        return super().get_queryset().select_related("owner").defer("contents")
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Add user permissions to context for template use
@@ -75,15 +96,18 @@ class EntryEditView(LoginRequiredMixin, OPAEntryPermissionMixin, UpdateView):
         return Entry.objects.all()
 
     def form_valid(self, form):
-        # If the entry was published, reset published_at to mark it as unpublished
-        if form.instance.is_published():
-            form.instance.published_at = None
+        # Edited entries go back to draft; unpublish() also removes the
+        # public copy, which resetting published_at alone left behind
+        was_published = form.instance.is_published()
+        response = super().form_valid(form)
+        if was_published:
+            self.object.unpublish()
             # Add a message to inform the user
             messages.info(
                 self.request,
                 "Entry unpublished due to changes. You can republish it from the list view.",
             )
-        return super().form_valid(form)
+        return response
 
 
 class EntryDeleteView(LoginRequiredMixin, OPAEntryPermissionMixin, DeleteView):
@@ -111,6 +135,10 @@ class EntryPublishView(LoginRequiredMixin, OPAEntryPermissionMixin, View):
 
     def post(self, request, pk):
         entry = get_object_or_404(Entry, pk=pk)
+
+        if request.POST.get("publish_at"):
+            return self.schedule(request, entry, request.POST["publish_at"])
+
         was_published = entry.is_published()
         entry.publish()
 
@@ -123,6 +151,22 @@ class EntryPublishView(LoginRequiredMixin, OPAEntryPermissionMixin, View):
 
         return HttpResponseRedirect(reverse_lazy("cms:entry_list"))
 
+    def schedule(self, request, entry, value):
+        try:
+            when = parse_datetime(value)
+        except ValueError:
+            when = None
+        if when is not None and timezone.is_naive(when):
+            when = timezone.make_aware(when)
+        if when is None or when <= timezone.now():
+            messages.error(request, "Choose a publication time in the future.")
+        else:
+            entry.schedule_publish(when)
+            messages.success(
+                request, f"Entry scheduled for {timezone.localtime(when):%b %d, %Y %H:%M}."
+            )
+        return HttpResponseRedirect(reverse_lazy("cms:entry_list"))
+
 class EntryUnpublishView(LoginRequiredMixin, OPAEntryPermissionMixin, View):
     login_url = "cms:login"
     required_permission = "unpublish"
@@ -146,5 +190,89 @@ class PublishedEntriesListView(OPAPermissionMixin, ListView):
     template_name = "cms/published_list.html"
     context_object_name = "published_entries"
     ordering = ["-published_at"]
+    paginate_by = 20
+    paginator_class = EstimatedCountPaginator
     required_permission = "view"
-    resource_type = "published_entries"
\ No newline at end of file
+    resource_type = "published_entries"
+    user_independent_policy = True
+
+    def get_queryset(self):
+        # The pre-rendered HTML is shown instead of the raw contents
+        return super().get_queryset().defer("contents")
+
+
+class PublishedSearchView(OPAPermissionMixin, ListView):
+    """Ranked full-text search over published entries"""
+    template_name = "cms/published_search.html"
+    context_object_name = "results"
+    paginate_by = 20
+    required_permission = "view"
+    resource_type = "published_entries"
+    user_independent_policy = True
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()
+        return SearchResults(self.query)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["query"] = self.query
+        return context
+
+
+class OPABundleView(View):
+    """Serve cms_authz.rego and data.users as an OPA bundle.
+
+    OPA polls with the ETag of the bundle it holds: an unchanged revision
+    gets 304, a known older revision of the same policy gets a delta bundle
+    of the changed users, anything else gets a full snapshot. The bundle
+    lists every user's groups, so it is only served to clients with a token
+    from ``OPA_BUNDLE_TOKENS``/``OPA_BUNDLE_TOKEN``.
+    """
+    http_method_names = ["get", "head"]
+
+    def get(self, request):
+        if not bundle_clients():
+            return HttpResponse("No OPA bundle token is configured", status=404)
+        client_name = authenticate_bundle_client(request.headers.get("Authorization", ""))
+        if client_name is None:
+            return HttpResponse(status=401)
+
+        revision = current_revision()
+        current = parse_revision(revision)
+        client_revision = request.headers.get("If-None-Match", "").removeprefix("W/").strip('"')
+        client = parse_revision(client_revision)
+        # What this OPA holds now; decisions for changes every client holds
+        # may be cached again
+        record_acknowledged_revision(client_name, client)
+        if client_revision == revision:
+            response = HttpResponse(status=304)
+            response["ETag"] = f'"{revision}"'
+            return response
+
+        bundle = None
+        if client and client[0] == current[0] and client[1] <= current[1]:
+            bundle = build_delta_bundle(client[1], revision)
+        if bundle is None:
+            bundle = build_snapshot_bundle(revision)
+
+        response = HttpResponse(bundle, content_type="application/gzip")
+        response["ETag"] = f'"{revision}"'
+        return response
+
+
+class ReadinessView(View):
+    """503 until the startup warm-up has finished, then 200"""
+    http_method_names = ["get", "head"]
+
+    def get(self, request):
+        ready = is_ready()
+        return JsonResponse({"ready": ready}, status=200 if ready else 503)
+
+
+class OPAAdmissionView(View):
+    """Admission control counters and queue depth of this process"""
+    http_method_names = ["get", "head"]
+
+    def get(self, request):
+        return JsonResponse(opa_client.admission_metrics())
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connections
+from django.template.loader import get_template
+from django.http import HttpRequest
+from django.urls import get_resolver, resolve, reverse
+
+from .opa_client import opa_client
+
+logger = logging.getLogger(__name__)
+
+_ready = threading.Event()
+
+
+def is_ready() -> bool:
+    """False only while a startup warm-up is still running"""
+    if not getattr(settings, "CMS_WARMUP_ON_STARTUP", False):
+        return True
+    return _ready.is_set()
+
+
+def load_urls():
+    resolver = get_resolver()
+    resolver.url_patterns  # Imports every urls/views module
+    resolver.reverse_dict  # Builds the reverse lookup tables
+    return f"{len(resolver.url_patterns)} top-level patterns"
+
+
+def load_templates():
+    template_dir = Path(__file__).resolve().parent / "templates"
+    names = sorted(
+        str(path.relative_to(template_dir)) for path in template_dir.glob("cms/*.html")
+    )
+    for name in names:
+        get_template(name)
+    return f"{len(names)} templates"
+
+
+def prime_opa_connections():
+    count = getattr(settings, "CMS_WARMUP_OPA_CONNECTIONS", 4)
+    healthy = opa_client.prime_connections(count)
+    if not healthy:
+        raise RuntimeError("OPA did not answer its health check")
+    return f"{healthy}/{count} connections"
+
+
+def replay_decisions():
+    """Ask OPA the decisions in CMS_WARMUP_DECISIONS, filling the cache"""
+    decisions = getattr(
+        settings, "CMS_WARMUP_DECISIONS", [(None, "view", "published_entries")]
+    )
+    usernames = {username for username, _, _ in decisions if username}
+    users = {
+        user.username: user
+        for user in User.objects.filter(username__in=usernames).prefetch_related("groups")
+    }
+
+    replayed = 0
+    for username, action, resource in decisions:
+        user = users.get(username) if username else AnonymousUser()
+        if user is None:
+            logger.warning(f"Warm-up user {username} does not exist, skipping")
+            continue
+        opa_client.check_permission(user, action, resource)
+        replayed += 1
+    return f"{replayed} decisions"
+
+
+def render_public_page():
+    path = reverse("published_list")
+    # Called straight into the view, so the request only needs what the
+    # view and its decorators read
+    request = HttpRequest()
+    request.method = "GET"
+    request.path = request.path_info = path
+    request.META = {"REQUEST_METHOD": "GET", "PATH_INFO": path}
+    request.user = AnonymousUser()
+    response = resolve(path).func(request)
+    if hasattr(response, "render"):
+        response.render()
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}")
+    return f"{path} ({len(response.content)} bytes)"
+
+
+WARMUP_STEPS = [
+    ("urls", load_urls),
+    ("templates", load_templates),
+    ("opa_connections", prime_opa_connections),
+    ("decisions", replay_decisions),
+    ("public_page", render_public_page),
+]
+
+
+def run_warmup() -> list:
+    """Run every warm-up step, then report ready.
+
+    A failing step is logged and does not stop the others. Returns
+    ``(name, ok, milliseconds, detail)`` for each step.
+    """
+    results = []
+    for name, step in WARMUP_STEPS:
+        start = time.perf_counter()
+        try:
+            detail = step()
+            ok = True
+        except Exception as e:
+            logger.warning(f"Warm-up step {name} failed: {e}")
+            detail = str(e)
+            ok = False
+        results.append((name, ok, (time.perf_counter() - start) * 1000, detail))
+
+    _ready.set()
+    logger.info("Warm-up complete, reporting ready")
+    return results
+
+
+def _background_warmup():
+    try:
+        run_warmup()
+    finally:
+        connections.close_all()
+
+
+def start_warmup():
+    """Startup hook for wsgi.py/asgi.py: warm up in the background while
+    the readiness endpoint reports 503.
+
+    Connections and in-process caches are per process, so this hook (not
+    the warmup command) is what warms the workers that serve traffic.
+    """
+    if not getattr(settings, "CMS_WARMUP_ON_STARTUP", False):
+        return
+    threading.Thread(target=_background_warmup, name="cms-warmup", daemon=True).start()
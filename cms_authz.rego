@@ -10,6 +10,16 @@ import future.keywords.in
 default allow := false
 default permissions := []
 
+# The user being authorized. Attributes come from the decision input or,
+# when OPA loads the bundle served by Django, from data.users so inputs
+# only need the user id.
+bundle_user := attributes if {
+    input.user.is_authenticated
+    attributes := data.users[sprintf("%v", [input.user.id])]
+} else := {}
+
+subject := object.union(bundle_user, input.user)
+
 # Helper functions for group checking
 has_group(user, group_name) if {
     group_name in user.groups
@@ -24,16 +34,16 @@ is_owner(user, resource_data) if {
 
 # Allow viewers to list all entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "viewer")
+    subject.is_authenticated
+    has_group(subject, "viewer")
     input.action == "list"
     input.resource == "entries"
 }
 
 # Allow viewers to view individual entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "viewer")
+    subject.is_authenticated
+    has_group(subject, "viewer")
     input.action == "view"
     input.resource == "entry"
 }
@@ -43,40 +53,40 @@ allow if {
 
 # Allow editors to list entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
+    subject.is_authenticated
+    has_group(subject, "editor")
     input.action == "list"
     input.resource == "entries"
 }
 
 # Allow editors to view individual entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
+    subject.is_authenticated
+    has_group(subject, "editor")
     input.action == "view"
     input.resource == "entry"
 }
 
 # Allow editors to create entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
+    subject.is_authenticated
+    has_group(subject, "editor")
     input.action == "create"
     input.resource == "entry"
 }
 
 # Allow editors to edit any entry
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
+    subject.is_authenticated
+    has_group(subject, "editor")
     input.action == "edit"
     input.resource == "entry"
 }
 
 # Allow editors to delete any entry
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
+    subject.is_authenticated
+    has_group(subject, "editor")
     input.action == "delete"
     input.resource == "entry"
 }
@@ -86,31 +96,31 @@ allow if {
 
 # Allow publishers to list entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "publisher")
+    subject.is_authenticated
+    has_group(subject, "publisher")
     input.action == "list"
     input.resource == "entries"
 }
 
 # Allow publishers to view individual entries
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "publisher")
+    subject.is_authenticated
+    has_group(subject, "publisher")
     input.action == "view"
     input.resource == "entry"
 }
 
 # ONLY publishers can publish/unpublish any entry
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "publisher")
+    subject.is_authenticated
+    has_group(subject, "publisher")
     input.action == "publish"
     input.resource == "entry"
 }
 
 allow if {
-    input.user.is_authenticated
-    has_group(input.user, "publisher")
+    subject.is_authenticated
+    has_group(subject, "publisher")
     input.action == "unpublish"
     input.resource == "entry"
 }
@@ -125,8 +135,8 @@ allow if {
 # ============= STAFF OVERRIDE =============
 # Staff users can do everything (Django admin access)
 allow if {
-    input.user.is_staff
-    input.action in ["list", "create", "edit", "delete", "publish", "moderate"]
+    subject.is_staff
+    input.action in ["list", "view", "create", "edit", "delete", "publish", "unpublish", "moderate"]
     input.resource in ["entry", "entries", "published_entries"]
 }
 
@@ -139,31 +149,49 @@ permissions := user_permissions if {
 
 # Viewer permissions
 user_permissions := ["view_all", "list"] if {
-    input.user.is_authenticated
-    has_group(input.user, "viewer")
-    not has_group(input.user, "editor")
-    not has_group(input.user, "publisher")
+    subject.is_authenticated
+    not subject.is_staff
+    has_group(subject, "viewer")
+    not has_group(subject, "editor")
+    not has_group(subject, "publisher")
 }
 
 # Editor permissions (includes viewer permissions)
 user_permissions := ["view_all", "list", "create", "edit_all", "delete_all"] if {
-    input.user.is_authenticated
-    has_group(input.user, "editor")
-    not has_group(input.user, "publisher")
+    subject.is_authenticated
+    not subject.is_staff
+    has_group(subject, "editor")
+    not has_group(subject, "publisher")
 }
 
 # Publisher permissions (includes all editor permissions)
 user_permissions := ["view_all", "list", "publish_all"] if {
-    input.user.is_authenticated
-    has_group(input.user, "publisher")
+    subject.is_authenticated
+    not subject.is_staff
+    has_group(subject, "publisher")
 }
 
-# Staff permissions (everything)
+# Staff permissions (everything; group rules above exclude staff so the
+# values never conflict)
 user_permissions := ["view_all", "list", "create", "edit_all", "delete_all", "publish_all", "moderate", "admin"] if {
-    input.user.is_staff
+    subject.is_staff
 }
 
 # Anonymous user permissions
 user_permissions := ["view_published"] if {
-    not input.user.is_authenticated
+    not subject.is_authenticated
+}
+
+# ============= BATCHED DECISIONS =============
+# Evaluate many action/resource pairs for one user in a single query, e.g.
+# {"user": {...}, "action": "batch", "resource": "decisions",
+#  "batch": [{"action": "list", "resource": "entries", "resource_data": {}}]}
+# Used to warm the Django decision cache at login.
+decisions[key] := decision if {
+    some req in input.batch
+    key := concat(":", [req.action, req.resource])
+    batch_input := object.union(input, req)
+    allowed := allow with input as batch_input
+    granted := permissions with input as batch_input
+    decision := {"allow": allowed, "permissions": granted}
 }
@@ -41,7 +41,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'cms.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'cms.middleware.PrimaryPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,9 +79,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'CONN_MAX_AGE': 60,  # Keep connections open between requests
+        'CONN_HEALTH_CHECKS': True,
+    },
+    # Read replicas are declared next to the primary, e.g.:
+    # "replica1": {
+    #     "ENGINE": "django.db.backends.postgresql",
+    #     "HOST": "replica1.internal",
+    #     ...
+    #     "CONN_MAX_AGE": 60,
+    #     "CONN_HEALTH_CHECKS": True,
+    #     "TEST": {"MIRROR": "default"},
+    # },
 }
 
+# Read/write routing: listing reads go to replicas, writes and reads that
+# follow a write go to the primary ("default").
+DATABASE_ROUTERS = ["cms.db_router.ReplicaRouter"]
+DATABASE_REPLICAS = None  # None = every alias in DATABASES except "default"
+DATABASE_REPLICA_MODELS = ["cms.entry", "cms.publishedentries"]
+REPLICA_PIN_COOKIE = "cms_primary_pin"
+REPLICA_PIN_SECONDS = 5  # Should exceed the worst expected replication lag
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -127,8 +148,91 @@ OPA_URL = "http://localhost:8181"
 OPA_POLICY_PATH = "cms/authz"
 OPA_CACHE_TIMEOUT = 300  # 5 minutes
 OPA_TIMEOUT = 5.0  # HTTP timeout in seconds
+OPA_CACHE_JITTER = 0.1  # Shorten each decision's TTL by up to 10% at random
+OPA_EARLY_REFRESH_BETA = 1.0  # Probabilistic early refresh of hot decisions (0 = off)
+OPA_SINGLE_FLIGHT_LOCK = False  # Also dedupe identical OPA queries across processes
+OPA_SINGLE_FLIGHT_LOCK_WAIT = 0.5  # Seconds to wait for another process's result
+OPA_MAX_CONNECTIONS = 20  # Pooled keep-alive connections to OPA
+# Path of a co-located OPA's Unix socket (opa run --server --addr
+# unix:///run/opa/opa.sock); OPA_URL then only names the host
+OPA_UNIX_SOCKET = None
+# Admission control: at most OPA_MAX_CONCURRENCY OPA calls per process (None
+# = unlimited), OPA_MAX_QUEUE more may wait up to OPA_QUEUE_TIMEOUT seconds;
+# the rest get the last known decision, kept OPA_STALE_TTL seconds past
+# expiry, or the fallback policy. Counters are at /healthz/opa/
+OPA_MAX_CONCURRENCY = 10
+OPA_MAX_QUEUE = 50
+OPA_QUEUE_TIMEOUT = 0.25
+OPA_STALE_TTL = 300
+OPA_WARMUP_ON_LOGIN = True  # Precompute a user's decisions in the background at login
+OPA_WARMUP_WORKERS = 2
+
+# OPA bundle served at /opa/bundles/cms.tar.gz (policy + data.users).
+# With OPA_USE_BUNDLE_DATA, decision inputs carry only the user id and OPA
+# reads groups/staff from the bundle.
+OPA_USE_BUNDLE_DATA = False
+# The bundle lists every user's groups: it is only served with a token. Give
+# each OPA instance its own ({name: token}) so decisions are only cached once
+# all of them hold a change; OPA_BUNDLE_TOKEN is a single instance's token
+OPA_BUNDLE_TOKEN = None
+OPA_BUNDLE_TOKENS = {}
+OPA_BUNDLE_CHANGELOG_SIZE = 10000  # Membership changes kept for delta bundles
+OPA_BUNDLE_MAX_DELTA_USERS = 500  # Larger deltas are sent as a snapshot
+OPA_BUNDLE_DELTA_OVERLAP = 100  # Changes below OPA's revision re-sent in deltas
+
+# Length of the plain-text excerpt stored for listing cards. Keep above 200:
+# entry_list.html marks cards longer than that as truncated.
+CMS_EXCERPT_LENGTH = 300
+
+# Entry contents are stored compressed once they reach this many bytes.
+# "zstd" is used when the optional zstandard package is installed.
+CMS_COMPRESSION_THRESHOLD = 1024
+CMS_COMPRESSION_ALGORITHM = "zlib"
+CMS_COMPRESSION_LEVEL = 6
+
+# Post-publish pipeline (python manage.py run_publish_worker)
+CMS_POST_PUBLISH_HANDLERS = []  # Dotted paths to handler(event, entry) callables
+CMS_PIPELINE_MAX_ATTEMPTS = 5
+CMS_PIPELINE_RETRY_BACKOFF = 10  # Seconds, doubled after every failed attempt
+CMS_PIPELINE_LEASE_SECONDS = 300  # Running events older than this are requeued
+
+# Admin changelists use the planner's row estimate (PostgreSQL/MySQL) instead
+# of COUNT(*) for unfiltered tables larger than this
+CMS_ADMIN_ESTIMATE_THRESHOLD = 100000
+
+# Full pages of public routes are cached for anonymous visitors, keyed by
+# path, page/q parameters, policy digest and a generation bumped on every
+# publish/unpublish, in their own cache
+CMS_PAGE_CACHE_TIMEOUT = 60
+CMS_PAGE_CACHE_ALIAS = "pages"
+
+# Full-text search over published entries (/published/search/). The backend
+# is picked from the database (SQLite FTS5 or PostgreSQL tsvector) unless
+# CMS_SEARCH_BACKEND names a cms.search.SearchBackend subclass
+CMS_SEARCH_BACKEND = None
+CMS_SEARCH_CONFIG = "english"  # PostgreSQL text search configuration
+CMS_SEARCH_SNIPPET_WORDS = 24
+CMS_SEARCH_MAX_TERMS = 10
+CMS_SEARCH_ADMIN_LIMIT = 1000  # Most full-text matches the admin search adds
+
+# Deploy warm-up (python manage.py warmup, or at startup from wsgi.py/asgi.py;
+# /healthz/ready/ answers 503 until it has finished)
+CMS_WARMUP_ON_STARTUP = False
+CMS_WARMUP_OPA_CONNECTIONS = 4
+# (username or None for anonymous, action, resource)
+CMS_WARMUP_DECISIONS = [
+    (None, "view", "published_entries"),
+]
+
+# Sessions are read from the cache and written through to the database;
+# users (with their group names) are loaded from the cache as well, so
+# identity costs no queries on a warm cache
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+AUTHENTICATION_BACKENDS = ["cms.backends.CachedModelBackend"]
+CMS_USER_CACHE_TIMEOUT = 300
 
-# Caching configuration for OPA responses
+# Caching configuration for OPA responses, sessions and users. With several
+# processes use a shared backend (Redis/Memcached) so invalidations reach all
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
@@ -137,9 +241,25 @@ CACHES = {
         "OPTIONS": {
             "MAX_ENTRIES": 1000,
         },
-    }
+    },
+    # Whole public pages and their generation (CMS_PAGE_CACHE_ALIAS), apart
+    # from the small keys above
+    "pages": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "cms-pages",
+        "OPTIONS": {
+            "MAX_ENTRIES": 1000,
+        },
+    },
 }
 
+# Server-Timing header with OPA/cache/SQL/template time per request (it
+# reveals backend timings; turn it off for untrusted clients), and sampled
+# span-tree logs of requests slower than CMS_SLOW_REQUEST_MS (None = off)
+CMS_SERVER_TIMING = DEBUG
+CMS_SLOW_REQUEST_MS = 1000
+CMS_SLOW_REQUEST_SAMPLE_RATE = 0.1
+
 # Logging configuration
 LOGGING = {
     "version": 1,
@@ -160,5 +280,10 @@ LOGGING = {
             "level": "DEBUG",
             "propagate": True,
         },
+        "cms.middleware": {
+            "handlers": ["console"],
+            "level": "WARNING",
+            "propagate": True,
+        },
     },
 }
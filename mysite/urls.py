@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from cms.urls import public_urlpatterns
+from cms.urls import health_urlpatterns, opa_urlpatterns, public_urlpatterns
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("cms/", include("cms.urls")),
+    path("opa/", include(opa_urlpatterns)),
+    path("healthz/", include(health_urlpatterns)),
 ] + public_urlpatterns
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Preload templates, OPA connections and caches before reporting ready
+# (only when CMS_WARMUP_ON_STARTUP is enabled)
+from cms.warmup import start_warmup  # noqa: E402
+
+start_warmup()